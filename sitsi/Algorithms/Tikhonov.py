@@ -30,20 +30,39 @@ also implement a finite difference operator in ``sitsi``. The scale factor
 
 """
 
+import concurrent.futures
 import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
 from .. InverterException import InverterException
 
 
 class Tikhonov:
     
 
-    def __init__(self, inp, method='standard', fitness=None):
+    def __init__(self, inp, method='standard', fitness=None, solver='lstsq', rank=None, energy=None, nprocs=1, radius=None, nonneg=False):
         """
         Constructor.
 
         method:  Name of Tikhonov method to use. Either 'standard' (uses a
-                 constant times an identity matrix for regularization), or
-                 'diff' (uses forward finite difference for regularization)
+                 constant times an identity matrix for regularization),
+                 'diff' (uses forward finite difference for regularization),
+                 'diff2' (uses second-order finite difference), 'rdiff'
+                 (uses forward finite difference weighted so that the
+                 penalty approximates the integral of r*(dx/dr)^2, which
+                 requires 'radius'), or 'svd' (uses the singular value
+                 decomposition of the Green's function). The operators
+                 of the difference methods are stored in banded form.
+        solver:  Solver to use with all methods except 'svd'.
+                 Either 'lstsq' (solves the full, stacked least-squares
+                 problem for every alpha), 'normal' (precomputes the
+                 Gram matrix G*G^T once, and solves the small N-by-N
+                 normal equations for every alpha using a Cholesky
+                 factorization), or one of the iterative solvers 'lsqr'
+                 and 'lsmr' (which only use products with the Green's
+                 function, with the regularization term added as
+                 damping).
         fitness: Fitness function to use, taking two input arguments:
                    (1) the input data, (2) the best fit output.
                  The default is to take the sum of differences squared, i.e.
@@ -51,16 +70,79 @@ class Tikhonov:
                  where a and b are the input and output vectors respectively.
         inp:     List of tuples, with each tuple consisting of the input data
                  as well as the Green's function which can be used to
-                 generate synthetic data for the input data.
+                 generate synthetic data for the input data. The Green's
+                 function may be given in single precision to save memory,
+                 but all factorizations and solves are done in double
+                 precision. The Green's functions may also be given as
+                 'scipy.sparse' matrices (which requires a solver other
+                 than 'lstsq' for all methods except 'svd').
+                 Green's functions which do not fit in memory can be given
+                 as an object which evaluates them block by block (such as
+                 'PixelBlocks'), in which case only one input can be given,
+                 and the 'normal' solver must be used (with any method
+                 except 'svd'). The Gram matrix is then accumulated one
+                 block of pixels at a time.
+        rank:    With the 'svd' method, maximum number of singular values
+                 to compute. If given (or if 'energy' is given), only the
+                 leading singular values are computed, using a randomized
+                 SVD. The number of singular values kept, and the fraction
+                 of the squared Frobenius norm of the Green's function
+                 which they account for, are stored in 'self.svd_rank' and
+                 'self.svd_energy' respectively.
+        energy:  With the 'svd' method, the smallest number of singular
+                 values which account for this fraction (between 0 and 1)
+                 of the squared Frobenius norm of the Green's function
+                 is kept (but at most 'rank').
+        nprocs:  Number of processes to use for accumulating the Gram
+                 matrix of a Green's function given block by block.
+        radius:  Radial grid on which the solution is given (used by
+                 the 'rdiff' method).
+        nonneg:  If 'True', the solution is constrained to be non-negative.
+                 The constrained problem is solved on the Gram matrix with
+                 the FNNLS active-set algorithm, starting from the active
+                 set of the previous solution (i.e. for a nearby alpha, or
+                 for the previous frame in 'invertSeries()'). This requires
+                 the 'normal' solver (and a method other than 'svd').
         """
         self.data  = []
         self.green = []
         self.fitness = fitness
+        self.alpha = None
+
+        # Factorizations are computed once, on first use
+        self.solvers    = None
+        self.spectral_W = None
+
+        # Initial guess for the iterative solvers
+        self.x0 = None
+
+        # Last solution of the non-negative problem (used as starting
+        # point for the next one)
+        self.nonneg       = nonneg
+        self.nonneg_x     = None
+        self.nonneg_alpha = None
 
         if not self.checkMethod(method.lower()):
             raise InverterException("Unrecognized method specified: '{}'.".format(method))
         self.method = method
 
+        if not self.checkSolver(solver.lower()):
+            raise InverterException("Unrecognized solver specified: '{}'.".format(solver))
+        self.solver = solver.lower()
+
+        if rank is not None and rank < 1:
+            raise InverterException("The rank of the truncated SVD must be positive.")
+        if energy is not None and not (0 < energy <= 1):
+            raise InverterException("The energy of the truncated SVD must be in the interval (0, 1].")
+        self.rank   = rank
+        self.energy = energy
+        self.nprocs = max(1, nprocs)
+        self.radius = None if radius is None else np.asarray(radius, dtype=np.float64)
+
+        # With the default fitness function, the fitness can be evaluated
+        # directly from the factorized problem for some methods
+        self.defaultFitness = (self.fitness is None)
+
         if self.fitness is None:
             self.fitness = lambda inp, synth : np.sum((inp - synth)**2)
 
@@ -69,53 +151,160 @@ class Tikhonov:
             self.data.append(i[0])
             self.green.append(i[1])
 
-        self.data = np.concatenate(self.data)
-        self.green = np.concatenate(self.green)
+        self.data = np.asarray(np.concatenate(self.data), dtype=np.float64)
+
+        self.sparse   = any([scipy.sparse.issparse(g) for g in self.green])
+        self.streamed = any([hasattr(g, 'nblocks') for g in self.green])
+        if self.streamed:
+            if len(self.green) != 1:
+                raise InverterException("Only one Green's function can be given when it is evaluated block by block.")
+            if self.method == 'svd' or self.solver != 'normal':
+                raise InverterException("Green's functions evaluated block by block require the 'normal' solver (and a method other than 'svd').")
+
+            self.green = self.green[0]
+        elif self.sparse:
+            self.green = scipy.sparse.vstack(self.green, format='csr')
+        else:
+            self.green = np.concatenate(self.green)
 
         if self.data.size != self.green.shape[1]:
             raise InverterException("Incompatible dimensions of input data and Green's function.")
 
+        if self.sparse and self.method != 'svd' and self.solver == 'lstsq':
+            raise InverterException("The 'lstsq' solver does not support sparse Green's functions.")
+
+        if self.nonneg and (self.method == 'svd' or self.solver != 'normal'):
+            raise InverterException("Non-negative solutions require the 'normal' solver (and a method other than 'svd').")
+
 
     def checkMethod(self, method):
         """
         Checks if the specified Tikhonov method is valid.
         """
-        return (method in ['diff', 'standard', 'svd'])
+        return (method in ['diff', 'diff2', 'rdiff', 'standard', 'svd'])
+
+
+    def checkSolver(self, solver):
+        """
+        Checks if the specified linear solver is valid.
+        """
+        return (solver in ['lsmr', 'lsqr', 'lstsq', 'normal'])
 
 
-    def invert(self):
+    def invert(self, criterion='bisection', alphas=None):
         """
         Solves for the optimum using a Tikhonov method.
         Returns a tuple consisting of the solution and the solution
-        multiplied with the input Green's function.
+        multiplied with the input Green's function. The regularization
+        parameter selected is stored in 'self.alpha'.
+
+        criterion: Method used to select the regularization parameter.
+                   Either 'bisection' (bisects log10(alpha) until the
+                   fitness starts to deviate from its minimum), 'curvature'
+                   (selects the corner of the L-curve, i.e. the point of
+                   maximum curvature) or 'gcv' (minimizes the generalized
+                   cross-validation function). With 'curvature' and 'gcv',
+                   the full L-curve is stored in 'self.curve'.
+        alphas:    Values of alpha to evaluate the L-curve in when using
+                   the 'curvature' or 'gcv' criteria (see 'lcurve()').
+        """
+        invfunc, resfunc = self._init()
+
+        if criterion == 'bisection':
+            self.alpha = self._bisection(invfunc, resfunc)
+        elif criterion == 'curvature':
+            curve = self.lcurve(alphas)
+            self.alpha = curve['alpha'][np.argmax(curve['curvature'])]
+        elif criterion == 'gcv':
+            curve = self.lcurve(alphas)
+            self.alpha = curve['alpha'][np.argmin(curve['gcv'])]
+        else:
+            raise InverterException("Unrecognized criterion for selecting alpha: '{}'.".format(criterion))
+
+        x, Ax = invfunc(self.alpha)
+
+        return x, Ax
+
+
+    def _init(self):
         """
+        Initializes the selected Tikhonov method. Returns the function
+        which solves the problem for a given alpha, as well as a function
+        which evaluates the sum of squared residuals in closed form
+        (or 'None' if no such function is available for the method).
+        """
+        if self.solvers is not None:
+            return self.solvers
+
         invfunc = None
-        if self.method == 'diff':
-            invfunc = self._invert_general
-            self._invert_general_init('diff')
-        elif self.method == 'standard':
+        resfunc = None
+        if self.method in ['diff', 'diff2', 'rdiff', 'standard']:
             invfunc = self._invert_general
-            self._invert_general_init('standard')
+            self._invert_general_init(self.method)
         elif self.method == 'svd':
             invfunc = self._invert_svd
             self._invert_svd_init()
         else:
             raise InverterException("Unrecognized method specified: '{}'.".format(self.method))
 
-        def evaluate(alpha):
-            _, Ax = invfunc(alpha)
-            return self.fitness(self.data, Ax)
+        if self.method != 'svd' and self.solver == 'normal':
+            resfunc = self._residual_normal
+        elif self.method == 'svd':
+            resfunc = self._residual_svd
+
+        self.solvers = (invfunc, resfunc)
+        return self.solvers
+
+
+    def _bisection(self, invfunc, resfunc, start=None, closedform=False):
+        """
+        Selects the regularization parameter by bisecting in log10(alpha)
+        until the fitness starts to deviate from its minimum.
+
+        If 'start' is given (e.g. the value of alpha selected for a similar
+        set of data), the search starts from this value (see
+        '_warmBracket()'), and falls back to bisecting the full range if
+        the optimum is not found close to it, or if the fit at 'start' has
+        degraded.
+
+        If 'closedform' is 'True', the minimum and maximum of the default
+        fitness function are taken from the factorization of the problem
+        (see '_spectral_init()') rather than by solving the problem for
+        the smallest and largest values of alpha.
+        """
+        if self.defaultFitness and resfunc is not None:
+            evaluate = resfunc
+        else:
+            def evaluate(alpha):
+                _, Ax = invfunc(alpha)
+                return self.fitness(self.data, Ax)
 
         lower, upper = -100, 100
-        minimum = evaluate(10.0 ** lower)
-        maximum = evaluate(10.0 ** upper)
+        if closedform and self.defaultFitness:
+            # At the upper end, x = 0 for all methods (see '_selectAlpha()'),
+            # while the constrained minimum must still be solved for
+            maximum = self.data.dot(self.data)
+            if self.nonneg:
+                minimum = evaluate(10.0 ** lower)
+            else:
+                minimum = self._residualMinimum(10.0 ** lower)
+        else:
+            minimum = evaluate(10.0 ** lower)
+            maximum = evaluate(10.0 ** upper)
 
         tol    = 1e-4
         tol_it = 0.1
 
+        def relfit(alpha):
+            return (evaluate(alpha) - minimum) / (maximum-minimum)
+
         def is_good(alpha):
-            fitness = evaluate(alpha)
-            return ((fitness - minimum) / (maximum-minimum)) < tol
+            return relfit(alpha) < tol
+
+        if start is not None:
+            bracket = self._warmBracket(lambda a : relfit(10.0 ** a), np.log10(start), lower, upper, tol, tol_it)
+            if bracket is not None:
+                lower, upper = bracket
 
         # L-curve method
         while (upper - lower) > tol_it:
@@ -125,11 +314,512 @@ class Tikhonov:
             else:
                 upper = mid
 
-        x, Ax = invfunc(10.0 ** lower)
+        return 10.0 ** lower
+
+
+    def _warmBracket(self, relfit, start, lower, upper, tol, tol_it, maxsteps=8, degraded=0.5):
+        """
+        Searches for a bracket [a, b] around the (logarithmic) value
+        'start', such that the relative fitness 'relfit(a)' is below 'tol'
+        and 'relfit(b)' is not, by taking steps of doubling length away
+        from 'start'. Returns 'None' if no bracket is found within
+        'maxsteps' steps, or if the fit at 'start' has degraded (i.e. the
+        relative fitness exceeds 'degraded'), in which case the optimum
+        is not expected to be close to 'start'.
+
+        All points tested lie on the grid of points which bisecting the
+        full range [lower, upper] can reach, and the bracket has a width
+        of a power of two times the grid spacing. Bisecting the bracket
+        therefore gives the same result as bisecting the full range (as
+        long as the fitness increases monotonically with alpha). If the
+        optimum has not moved, only two points are tested.
+        """
+        n = int(np.ceil(np.log2((upper - lower) / tol_it)))
+        h = (upper - lower) / 2**n
+
+        k = int(round((start - lower) / h))
+        a = lower + min(max(k, 1), 2**n - 1) * h
+
+        fit = relfit(a)
+        if not (fit <= degraded):
+            return None
+
+        def is_good(a):
+            return relfit(a) < tol
+
+        step = h
+        if fit < tol:
+            for _ in range(maxsteps):
+                b = a + step
+                if b >= upper:
+                    return None
+                elif not is_good(b):
+                    return a, b
+
+                a, step = b, 2*step
+        else:
+            b = a
+            for _ in range(maxsteps):
+                a = b - step
+                if a <= lower:
+                    return None
+                elif is_good(a):
+                    return a, b
+
+                b, step = a, 2*step
+
+        return None
+
+
+    def lcurve(self, alphas=None, n=200):
+        """
+        Evaluates the L-curve for all the given values of alpha in one
+        batched operation, using a factorization of the problem which is
+        computed once. Returns a dict with the elements
+
+          alpha:     Values of alpha.
+          residual:  Residual norm || b - A*x || for each alpha.
+          solution:  (Semi-)norm of the solution || D*x || for each alpha.
+          curvature: Curvature of the L-curve (in log-log scale).
+          gcv:       Generalized cross-validation function.
+
+        The dict is also stored in 'self.curve'.
+
+        alphas: Values of alpha to evaluate the L-curve in. If 'None',
+                'n' logarithmically spaced values covering the range of
+                (generalized) singular values of the problem are used.
+        n:      Number of values of alpha to use when 'alphas' is 'None'.
+        """
+        self._spectral_init()
+
+        if alphas is None:
+            alphas = self._alphaGrid(n)
+        alphas = np.asarray(alphas, dtype=np.float64)
+
+        if self.nonneg:
+            self.curve = self._nonneg_curve(alphas)
+            return self.curve
+
+        z  = self._spectral_project(self.data[np.newaxis,:])[0]
+        bb = self.data.dot(self.data)
+
+        self.curve = self._spectral_curve(z, bb, alphas)
+        return self.curve
+
+
+    def invertFrames(self, frames, alpha=None, criterion='bisection', alphas=None, blocksize=256):
+        """
+        Inverts several sets of input data (e.g. the frames of a video)
+        which all share the Green's function of this object. The problem
+        is factorized once, and all frames are projected onto the
+        factorization (and transformed back) using matrix-matrix products.
+        The data given to the constructor is not used. Only the default
+        fitness function is supported.
+
+        Returns a tuple consisting of the solutions, as a (frames, N)
+        array, and the regularization parameter used for each frame.
+
+        frames:    Array of shape (frames, pixels) containing the data
+                   (any further dimensions are flattened).
+        alpha:     Regularization parameter to use for all frames (or an
+                   array with one value per frame). If 'None', alpha is
+                   selected separately for each frame using 'criterion'.
+        criterion: Method used to select alpha (see 'invert()').
+        alphas:    Values of alpha to evaluate the L-curve in when using
+                   the 'curvature' or 'gcv' criteria.
+        blocksize: Number of frames to process simultaneously.
+        """
+        if not self.defaultFitness:
+            raise InverterException("Inversion of multiple frames only supports the default fitness function.")
+        if self.nonneg:
+            raise InverterException("Inversion of multiple frames does not support non-negative solutions. Use 'invertSeries()' instead.")
+
+        frames = np.asarray(frames)
+        frames = frames.reshape((frames.shape[0], -1))
+        if frames.shape[1] != self.green.shape[1]:
+            raise InverterException("Incompatible dimensions of input data and Green's function.")
+
+        self._spectral_init()
+
+        if alpha is None and criterion != 'bisection' and alphas is None:
+            alphas = self._alphaGrid(200)
+
+        nframes = frames.shape[0]
+        x = np.zeros((nframes, self.green.shape[0]))
+        a = np.zeros((nframes,))
+        if alpha is not None:
+            a[:] = alpha
+
+        for i in range(0, nframes, blocksize):
+            b  = np.asarray(frames[i:i+blocksize], dtype=np.float64)
+            z  = self._spectral_project(b)
+            bb = np.sum(b**2, axis=1)
+
+            if alpha is None:
+                a[i:i+blocksize] = self._selectAlpha(z, bb, criterion, alphas)
+
+            x[i:i+blocksize] = self._spectral_solve(z, a[i:i+blocksize])
+
+        return x, a
+
+
+    def invertSeries(self, frames, criterion='bisection', alphas=None):
+        """
+        Inverts a sequence of sets of input data (e.g. consecutive frames
+        of a video) one at a time, sharing the Green's function of this
+        object. Since consecutive frames are usually similar, the search
+        for alpha (with the 'bisection' criterion) starts from the value
+        selected for the previous frame, and the iterative solvers start
+        from the previous solution. With the default fitness function,
+        the range of the fitness is obtained from a factorization of the
+        problem (computed once) instead of being solved for in every
+        frame. Unlike 'invertFrames()', any solver
+        and fitness function can be used (as well as non-negative
+        solutions).
+
+        Returns a tuple consisting of the solutions, as a (frames, N)
+        array, and the regularization parameter selected for each frame.
+
+        frames:    Array of shape (frames, pixels) containing the data
+                   (any further dimensions are flattened).
+        criterion: Method used to select alpha (see 'invert()').
+        alphas:    Values of alpha to evaluate the L-curve in when using
+                   the 'curvature' or 'gcv' criteria.
+        """
+        frames = np.asarray(frames)
+        frames = frames.reshape((frames.shape[0], -1))
+
+        invfunc, resfunc = self._init()
+        data = self.data
+
+        x = np.zeros((frames.shape[0], self.green.shape[0]))
+        a = np.zeros((frames.shape[0],))
+
+        try:
+            for i in range(frames.shape[0]):
+                self._setData(frames[i])
+
+                if criterion == 'bisection':
+                    self.alpha = self._bisection(invfunc, resfunc, start=(a[i-1] if i > 0 else None), closedform=True)
+                    x[i], _ = invfunc(self.alpha)
+                else:
+                    x[i], _ = self.invert(criterion=criterion, alphas=alphas)
+
+                a[i] = self.alpha
+
+                if self.solver in ['lsqr', 'lsmr']:
+                    self.x0 = x[i]
+        finally:
+            self.x0 = None
+            self._setData(data)
+
+        return x, a
+
+
+    def _setData(self, data):
+        """
+        Replaces the input data, updating the quantities which have been
+        precomputed from it (but keeping all factorizations of the Green's
+        function).
+        """
+        data = np.asarray(data, dtype=np.float64).ravel()
+        if data.size != self.green.shape[1]:
+            raise InverterException("Incompatible dimensions of input data and Green's function.")
+
+        self.data = data
+
+        if self.solvers is None:
+            return
+
+        if self.method == 'svd':
+            self.svd_beta = self.svd_u.T.dot(self.data)
+            self.svd_bb   = self.data.dot(self.data)
+            return
+
+        self.diff_b = np.hstack((self.data, np.zeros(self.diff_D.shape[0])))
+
+        if hasattr(self, 'normal_GG'):
+            if self.streamed:
+                self.normal_Gb = self._adjoint(self.data[np.newaxis,:])[0]
+            else:
+                self.normal_Gb = self._greenDot(self.data)
+
+            self.normal_bb = self.data.dot(self.data)
+            self.normal_c  = None
+
+            # Keep the last solution as starting point
+            self.nonneg_alpha = None
+
+        if hasattr(self, 'gsvd_V'):
+            self.gsvd_y = self.gsvd_V.T.dot(self.normal_Gb)
+
+
+    def _greenDot(self, b, blocksize=4096):
+        """
+        Computes G*b in double precision (converting the Green's function
+        in blocks of pixels if it is stored in lower precision).
+        """
+        if self.sparse or self.green.dtype == np.float64:
+            return self.green.dot(b)
+
+        Gb = np.zeros((self.green.shape[0],))
+        for i in range(0, self.green.shape[1], blocksize):
+            Gb += self.green[:,i:i+blocksize].astype(np.float64).dot(b[i:i+blocksize])
+
+        return Gb
+
+
+    def _selectAlpha(self, z, bb, criterion, alphas):
+        """
+        Selects the regularization parameter for each of the projected
+        data vectors in the rows of 'z' (with squared norms 'bb').
+        """
+        if criterion == 'bisection':
+            # Vectorized version of the bisection in '_bisection()'
+            lower = np.full(bb.shape, -100.0)
+            upper = np.full(bb.shape, 100.0)
+            minimum = self._spectral_residual(z, bb, 10.0 ** lower)
+
+            # At the upper end, the least-squares solvers used by 'invert()'
+            # also truncate the null space of the regularization operator,
+            # and so yield x = 0 for all methods
+            maximum = bb
+
+            tol    = 1e-4
+            tol_it = 0.1
+
+            while np.any((upper - lower) > tol_it):
+                mid = (upper + lower) / 2
+                fitness = self._spectral_residual(z, bb, 10.0 ** mid)
+                good = ((fitness - minimum) / (maximum-minimum)) < tol
+
+                lower = np.where(good, mid, lower)
+                upper = np.where(good, upper, mid)
+
+            return 10.0 ** lower
+        elif criterion == 'curvature':
+            curve = self._spectral_curve(z, bb, alphas)
+            return alphas[np.argmax(curve['curvature'], axis=-1)]
+        elif criterion == 'gcv':
+            curve = self._spectral_curve(z, bb, alphas)
+            return alphas[np.argmin(curve['gcv'], axis=-1)]
+        else:
+            raise InverterException("Unrecognized criterion for selecting alpha: '{}'.".format(criterion))
+
+
+    def _spectral_init(self):
+        """
+        Brings the problem on the form of a (generalized) singular value
+        decomposition, in which the regularized solution is
+
+          x = W * (phi * z / s),     phi = gamma^2 / (gamma^2 + alpha^2),
+
+        where z is the projection of the data, s the (generalized) singular
+        values and gamma the values at which the filter factors phi switch
+        off. For the 'svd' method, W = V and gamma = s, while for the other
+        methods the simultaneous diagonalization of '_gsvd_init()' is used.
+        """
+        if self.spectral_W is not None:
+            return
+
+        self._init()
+
+        if self.method == 'svd':
+            s = self.svd_s
+
+            self.spectral_W     = self.svd_vt.T
+            self.spectral_sinv  = np.divide(1, s, out=np.zeros(s.shape), where=(s>0))
+            self.spectral_g2inv = np.divide(1, s**2, out=np.full(s.shape, np.inf), where=(s>0))
+            self.spectral_norm  = np.ones(s.shape)
+            self.spectral_WtW   = None
+        else:
+            self._gsvd_init()
+            mu, sigma2 = self.gsvd_mu, self.gsvd_sigma2
+            s = np.sqrt(1-mu)
+
+            self.spectral_W     = self.gsvd_V
+            self.spectral_sinv  = np.divide(1, s, out=np.zeros(s.shape), where=(s>0))
+            self.spectral_g2inv = np.divide(mu, sigma2*(1-mu), out=np.full(s.shape, np.inf), where=(s>0))
+            self.spectral_norm  = mu / sigma2
+            self.spectral_WtW   = self.gsvd_V.T.dot(self.gsvd_V)
+
+
+    def _residualMinimum(self, alpha):
+        """
+        Evaluates the sum of squared residuals for the (small) value
+        'alpha' from the factorization computed in '_spectral_init()',
+        without solving the problem.
+        """
+        self._spectral_init()
+
+        if self.method == 'svd':
+            z = self.svd_beta
+        else:
+            z = self.gsvd_y * self.spectral_sinv
+
+        return self._spectral_residual(z, self.data.dot(self.data), alpha)
+
+
+    def _spectral_project(self, b):
+        """
+        Projects the data vectors in the rows of 'b' onto the
+        factorization computed in '_spectral_init()'.
+        """
+        if self.method == 'svd':
+            return b.dot(self.svd_u)
+        elif self.streamed:
+            return self._adjoint(b).dot(self.gsvd_V) * self.spectral_sinv
+        elif self.sparse:
+            return self.green.dot(b.T).T.dot(self.gsvd_V) * self.spectral_sinv
+        else:
+            return b.dot(self.green.T).dot(self.gsvd_V) * self.spectral_sinv
+
+
+    def _spectral_filter(self, alpha):
+        """
+        Returns the filter factors for the given values of alpha (which
+        is broadcast against the last dimension of the factorization).
+        """
+        return 1 / (1 + np.asarray(alpha)[...,np.newaxis]**2 * self.spectral_g2inv)
+
+
+    def _spectral_residual(self, z, bb, alpha):
+        """
+        Evaluates the sum of squared residuals for the projected data 'z'
+        (with squared norm 'bb') and regularization parameter(s) 'alpha'.
+        """
+        phi = self._spectral_filter(alpha)
+        return bb - np.sum(z**2 * phi * (2-phi), axis=-1)
+
+
+    def _spectral_solve(self, z, alpha):
+        """
+        Returns the regularized solutions for the projected data 'z' and
+        regularization parameters 'alpha'.
+        """
+        phi = self._spectral_filter(alpha)
+        return (phi * z * self.spectral_sinv).dot(self.spectral_W.T)
+
+
+    def _spectral_curve(self, z, bb, alphas):
+        """
+        Evaluates the L-curve (see 'lcurve()') for the projected data in
+        'z', which may contain several data vectors along its first axis.
+        """
+        z  = z[...,np.newaxis,:]
+        bb = np.asarray(bb)[...,np.newaxis]
+
+        phi = self._spectral_filter(alphas)
+
+        c     = phi * z * self.spectral_sinv
+        res2  = bb - np.sum(z**2 * phi * (2-phi), axis=-1)
+        sol2  = np.sum(c**2 * self.spectral_norm, axis=-1)
+        trace = np.sum(phi, axis=-1)
+
+        # Guard against round-off making the residual negative
+        res2 = np.maximum(res2, np.finfo(np.float64).eps * bb)
+
+        # The seminorm || D*x || is only resolved if it is not negligible
+        # compared to || x || (see '_nonneg_curve()')
+        resolved = None
+        if self.spectral_WtW is not None:
+            xnorm2 = np.sum(c.dot(self.spectral_WtW) * c, axis=-1)
+            tol = np.sqrt(np.finfo(np.float64).eps) * scipy.sparse.linalg.norm(self.diff_D, 1)
+            resolved = sol2 > tol**2 * xnorm2
+
+        return {
+            'alpha': alphas,
+            'residual': np.sqrt(res2),
+            'solution': np.sqrt(sol2),
+            'curvature': self._curvature(alphas, np.sqrt(res2), np.sqrt(sol2), valid=resolved),
+            'gcv': res2 / (self.green.shape[1] - trace)**2
+        }
+
+
+    def _alphaGrid(self, n):
+        """
+        Returns 'n' logarithmically spaced values of alpha covering the
+        (generalized) singular values of the problem (with some margin).
+        """
+        gamma = 1 / np.sqrt(self.spectral_g2inv[(self.spectral_g2inv > 0) & np.isfinite(self.spectral_g2inv)])
+
+        gmax = np.amax(gamma)
+        gmin = max(np.amin(gamma), gmax * np.sqrt(np.finfo(np.float64).eps))
+
+        return np.logspace(np.log10(gmin)-2, np.log10(gmax)+1, n)
+
+
+    def _curvature(self, alphas, residual, solution, valid=None):
+        """
+        Evaluates the curvature of the L-curve given by the residual norm
+        and solution norm (as functions of alpha, along the last axis), in
+        log-log scale. Parts of the curve where neither norm changes, or
+        where either norm is negligible compared to its maximum, are
+        dominated by round-off, and are given a curvature of -inf (as
+        are points where 'valid', if given, is false).
+        """
+        t   = np.log(alphas)
+        rho = np.log(residual)
+        eta = np.log(solution)
+
+        drho = np.gradient(rho, t, axis=-1)
+        deta = np.gradient(eta, t, axis=-1)
+        ddrho = np.gradient(drho, t, axis=-1)
+        ddeta = np.gradient(deta, t, axis=-1)
+
+        speed = np.sqrt(drho**2 + deta**2)
+
+        errs = np.geterr()
+        np.seterr(divide='ignore', invalid='ignore')
+        kappa = (drho*ddeta - ddrho*deta) / speed**3
+        np.seterr(**errs)
+
+        tol = np.sqrt(np.finfo(np.float64).eps)
+        valid = (residual > tol*np.amax(residual, axis=-1, keepdims=True)) \
+              & (solution > tol*np.amax(solution, axis=-1, keepdims=True)) \
+              & (True if valid is None else valid)
+
+        speed = np.where(valid, speed, 0)
+        kappa[~(speed > 1e-3*np.amax(speed, axis=-1, keepdims=True))] = -np.inf
+
+        return kappa
+
+
+    def _gsvd_init(self):
+        """
+        Computes a simultaneous diagonalization of G*G^T and D^T*D, which
+        allows the solution for any alpha to be obtained by rescaling. With
+
+          V^T * (G*G^T + sigma^2 * D^T*D) * V = I,
+          V^T * sigma^2 * D^T*D * V = diag(mu),
+
+        the solution is
+
+          x = V * diag(1 / (1 - mu + mu*alpha^2/sigma^2)) * V^T * G*b.
+
+        The scale factor sigma^2 is chosen to balance the two terms.
+        """
+        if self.solver != 'normal':
+            self._invert_normal_init()
+
+        sigma2 = np.trace(self.normal_GG) / np.trace(self.normal_DD)
+
+        try:
+            mu, V = scipy.linalg.eigh(sigma2*self.normal_DD, self.normal_GG + sigma2*self.normal_DD)
+        except np.linalg.LinAlgError:
+            raise InverterException("The Green's function and regularization operator have a common null space.")
+
+        # In the null space of D, mu is only round-off, and must be zero
+        # so that these components are not regularized (or resolved)
+        mu = np.clip(mu, 0, 1)
+        mu[mu <= mu.size * np.finfo(np.float64).eps * np.amax(mu)] = 0
+
+        self.gsvd_mu     = mu
+        self.gsvd_V      = V
+        self.gsvd_y      = V.T.dot(self.normal_Gb)
+        self.gsvd_sigma2 = sigma2
 
-        return x, Ax
 
-    
     def _invert_general_init(self, method='standard'):
         """
         Initializes the general Tikhonov methods.
@@ -137,18 +827,42 @@ class Tikhonov:
         N = self.green.shape[0]
 
         # SELECT OPERATOR TO ADD
+        #   The operators are stored as sparse (banded) matrices, and
+        #   'diff_u' is the number of superdiagonals of D^T*D
         if method == 'diff':
             # (Upwind) finite difference
-            self.diff_D = (np.eye(N) - np.eye(N, k=1))[:-1]
+            self.diff_D = scipy.sparse.diags([1.0, -1.0], [0, 1], shape=(N-1, N), format='csr')
+            self.diff_u = 1
+        elif method == 'diff2':
+            # Second-order finite difference
+            self.diff_D = scipy.sparse.diags([1.0, -2.0, 1.0], [0, 1, 2], shape=(N-2, N), format='csr')
+            self.diff_u = 2
+        elif method == 'rdiff':
+            # Finite difference weighted so that
+            #   || D*x ||^2 = sum_i r_{i+1/2} * dr_i * ((x_{i+1}-x_i) / dr_i)^2
+            if self.radius is None or self.radius.shape != (N,):
+                raise InverterException("The 'rdiff' method requires a radial grid with one point per unknown.")
+
+            dr = np.diff(self.radius)
+            if np.any(dr <= 0):
+                raise InverterException("The radial grid must be strictly increasing.")
+
+            w = np.sqrt(0.5*(self.radius[1:] + self.radius[:-1]) / dr)
+            self.diff_D = scipy.sparse.diags([w, -w], [0, 1], shape=(N-1, N), format='csr')
+            self.diff_u = 1
         elif method == 'standard':
             # Scaled identity matrix
-            self.diff_D = np.eye(N)
+            self.diff_D = scipy.sparse.identity(N, format='csr')
+            self.diff_u = 0
         else:
             raise InverterException("Unrecognized generalized Tikhonov method specified: '{}'.".format(method))
 
         # Set up input vector
         self.diff_b = np.hstack((self.data, np.zeros(self.diff_D.shape[0])))
 
+        if self.solver == 'normal':
+            self._invert_normal_init()
+
 
     def _invert_general(self, alpha):
         """
@@ -161,37 +875,618 @@ class Tikhonov:
 
           min || A*x - b + alpha*D ||^2
         """
-        # Construct matrix to invert
-        A = np.vstack((self.green.T, alpha * self.diff_D))
+        if self.solver == 'normal':
+            x = self._solve_normal(alpha)
+        elif self.solver in ['lsqr', 'lsmr']:
+            x = self._solve_iterative(alpha)
+        else:
+            # Construct matrix to invert
+            A = np.vstack((self.green.T, alpha * self.diff_D.toarray()))
+
+            x, _, _, _ = np.linalg.lstsq(A, self.diff_b, rcond=None)
 
-        x, _, _, _ = np.linalg.lstsq(A, self.diff_b, rcond=None)
-        img = self.green.T.dot(x)
+        img = self._forward(x)
 
         return x, img
 
 
+    def _solve_iterative(self, alpha, tol=1e-10):
+        """
+        Solves the regularized least-squares problem for the given value of
+        alpha using LSQR or LSMR, which only require products with the
+        Green's function (and its transpose). For the 'standard' method,
+        the regularization is applied as the damping of the solver, while
+        for other methods the solver is given the stacked operator
+        [G^T; alpha*D] as a 'LinearOperator'.
+
+        If 'self.x0' is set, the solver starts from this solution, unless
+        it is a worse approximation than the zero vector (e.g. because
+        alpha is very large). Since the damping of the solvers applies to
+        the correction to the initial guess, the stacked operator is then
+        used for all methods.
+        """
+        npix = self.green.shape[1]
+        G, D = self.green, self.diff_D
+        A = scipy.sparse.linalg.LinearOperator(
+            (npix + D.shape[0], G.shape[0]),
+            matvec=lambda x : np.concatenate((G.T.dot(x), alpha*D.dot(x))),
+            rmatvec=lambda y : G.dot(y[:npix]) + alpha*D.T.dot(y[npix:]),
+            dtype=np.float64
+        )
+
+        x0 = self.x0
+        if x0 is not None and np.linalg.norm(A.matvec(x0) - self.diff_b) >= np.linalg.norm(self.diff_b):
+            x0 = None
+
+        # In exact arithmetic, the solvers converge in N iterations
+        maxiter = 10*self.green.shape[0]
+        if self.solver == 'lsqr':
+            solve = lambda A, b, damp=0 : scipy.sparse.linalg.lsqr(A, b, damp=damp, atol=tol, btol=tol, iter_lim=maxiter, x0=x0)[0]
+        else:
+            solve = lambda A, b, damp=0 : scipy.sparse.linalg.lsmr(A, b, damp=damp, atol=tol, btol=tol, maxiter=maxiter, x0=x0)[0]
+
+        if self.method == 'standard' and x0 is None:
+            return solve(G.T, self.data, damp=alpha)
+
+        return solve(A, self.diff_b)
+
+
+    def _invert_normal_init(self):
+        """
+        Precomputes the quantities needed to solve the normal equations
+
+          (G*G^T + alpha^2 * D^T*D) x = G*b
+
+        for any value of alpha.
+        """
+        self.normal_GG, self.normal_Gb = self._gram()
+        self.normal_bb = self.data.dot(self.data)
+        self.normal_DD = self.diff_D.T.dot(self.diff_D).toarray()
+
+        # If G*G^T is banded (e.g. because every pixel only sees a few
+        # radii), the normal equations are solved in banded form, at a
+        # cost which is linear in N (for a fixed bandwidth). For small
+        # systems, the dense factorization is faster.
+        N = self.normal_GG.shape[0]
+        u = max(self._bandwidth(self.normal_GG), self.diff_u)
+        if N >= 100 and u < N // 4:
+            self.normal_band = u
+            self.normal_GGb  = self._toBanded(self.normal_GG, u)
+            self.normal_DDb  = self._toBanded(self.normal_DD, u)
+            self.normal_GGs  = scipy.sparse.csr_matrix(self.normal_GG)
+        else:
+            self.normal_band = None
+
+        # Square-root factor of G*G^T (only computed if needed)
+        self.normal_R = None
+        self.normal_c = None
+
+
+    def _gram(self, blocksize=4096):
+        """
+        Computes G*G^T and G*b in double precision. If the Green's function
+        is stored in lower precision, the pixels are converted in blocks so
+        that a double precision copy of the full Green's function is never
+        needed. Sparse Green's functions are multiplied in sparse format.
+        """
+        if self.streamed:
+            return self._gram_streamed()
+        elif self.sparse:
+            G = self.green.astype(np.float64, copy=False)
+            return G.dot(G.T).toarray(), G.dot(self.data)
+        elif self.green.dtype == np.float64:
+            return self.green.dot(self.green.T), self.green.dot(self.data)
+
+        N, npix = self.green.shape
+        GG = np.zeros((N, N))
+        Gb = np.zeros((N,))
+        for i in range(0, npix, blocksize):
+            g = self.green[:,i:i+blocksize].astype(np.float64)
+            GG += g.dot(g.T)
+            Gb += g.dot(self.data[i:i+blocksize])
+
+        return GG, Gb
+
+
+    def _gram_streamed(self):
+        """
+        Accumulates G*G^T and G*b over the blocks of a Green's function
+        which is evaluated block by block. With several processes, every
+        process handles a contiguous range of blocks.
+        """
+        chunks = np.array_split(np.arange(self.green.nblocks), self.nprocs)
+        chunks = [c for c in chunks if c.size > 0]
+
+        if len(chunks) <= 1:
+            return _gramBlocks(self.green, self.data, range(self.green.nblocks))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(chunks)) as ex:
+            parts = list(ex.map(_gramBlocks, [self.green]*len(chunks), [self.data]*len(chunks), chunks))
+
+        return sum([p[0] for p in parts]), sum([p[1] for p in parts])
+
+
+    def _forward(self, x):
+        """
+        Returns the synthetic data G^T*x corresponding to the solution x.
+        """
+        if not self.streamed:
+            return self.green.T.dot(x)
+
+        img = np.zeros((self.green.shape[1],))
+        for k in range(self.green.nblocks):
+            cols, g = self.green.block(k)
+            img[cols] = g.T.dot(x)
+
+        return img
+
+
+    def _adjoint(self, b):
+        """
+        Returns the products G*b of the Green's function with the data
+        vectors in the rows of 'b' (as rows), for a Green's function which
+        is evaluated block by block.
+        """
+        Gb = np.zeros((b.shape[0], self.green.shape[0]))
+        for k in range(self.green.nblocks):
+            cols, g = self.green.block(k)
+            Gb += g.dot(b[:,cols].T).T
+
+        return Gb
+
+
+    def _solve_normal(self, alpha):
+        """
+        Solves the normal equations for the given value of alpha.
+        """
+        if self.nonneg:
+            return self._solve_nonneg(alpha)
+
+        if self.normal_band is not None:
+            x = self._solve_banded(alpha)
+            if x is not None:
+                return x
+
+        M = self.normal_GG + alpha**2 * self.normal_DD
+
+        try:
+            cf = scipy.linalg.cho_factor(M, check_finite=False)
+            rcond, _ = scipy.linalg.lapack.dpocon(cf[0], np.linalg.norm(M, 1), uplo='L' if cf[1] else 'U')
+
+            if rcond > np.finfo(M.dtype).eps:
+                return scipy.linalg.cho_solve(cf, self.normal_Gb, check_finite=False)
+        except np.linalg.LinAlgError:
+            pass
+
+        # The normal equations are (numerically) singular, so we instead
+        # solve the equivalent least-squares problem
+        #
+        #   min || R*x - c ||^2 + || alpha*D*x ||^2
+        #
+        # where R^T*R = G*G^T and R^T*c = G*b
+        if self.normal_R is None:
+            lmbd, V = np.linalg.eigh(self.normal_GG)
+            lmbd = np.sqrt(np.maximum(lmbd, 0))
+            s = np.divide(1, lmbd, out=np.zeros(lmbd.shape), where=(lmbd > lmbd[-1]*np.finfo(lmbd.dtype).eps))
+
+            self.normal_R = lmbd[:,np.newaxis] * V.T
+            self.normal_P = s[:,np.newaxis] * V.T
+            self.normal_c = None
+
+        if self.normal_c is None:
+            self.normal_c = self.normal_P.dot(self.normal_Gb)
+
+        A = np.vstack((self.normal_R, alpha * self.diff_D.toarray()))
+        b = np.hstack((self.normal_c, np.zeros(self.diff_D.shape[0])))
+        x, _, _, _ = np.linalg.lstsq(A, b, rcond=None)
+
+        return x
+
+
+    def _solve_banded(self, alpha):
+        """
+        Solves the normal equations for the given value of alpha using a
+        banded Cholesky factorization. Returns 'None' if the equations are
+        (numerically) singular.
+        """
+        ab = self.normal_GGb + alpha**2 * self.normal_DDb
+
+        try:
+            c = scipy.linalg.cholesky_banded(ab, check_finite=False)
+        except np.linalg.LinAlgError:
+            return None
+
+        solve = lambda v : scipy.linalg.cho_solve_banded((c, False), v, check_finite=False)
+
+        # Estimate the reciprocal condition number using a few solves
+        # with the factorization (LAPACK's 'dpbcon' is not available)
+        n = ab.shape[1]
+        Minv = scipy.sparse.linalg.LinearOperator((n, n), matvec=solve, rmatvec=solve, matmat=solve, dtype=np.float64)
+        rcond = 1 / (self._bandedNorm1(ab) * scipy.sparse.linalg.onenormest(Minv))
+
+        if rcond > np.finfo(ab.dtype).eps:
+            return solve(self.normal_Gb)
+        else:
+            return None
+
+
+    def _bandwidth(self, M):
+        """
+        Returns the number of non-zero superdiagonals of the symmetric
+        matrix M.
+        """
+        i, j = np.nonzero(M)
+        return int(np.amax(j - i)) if i.size > 0 else 0
+
+
+    def _toBanded(self, M, u):
+        """
+        Converts the symmetric matrix M, with 'u' superdiagonals, to the
+        upper banded form used by LAPACK, i.e. ab[u+i-j, j] = M[i,j].
+        """
+        ab = np.zeros((u+1, M.shape[0]))
+        for d in range(u+1):
+            ab[u-d, d:] = np.diagonal(M, d)
+
+        return ab
+
+
+    def _bandedNorm1(self, ab):
+        """
+        Returns the 1-norm of the symmetric matrix stored in upper banded
+        form in 'ab'.
+        """
+        u = ab.shape[0] - 1
+        a = np.abs(ab)
+
+        # Upper part (and diagonal) of every column
+        s = np.sum(a, axis=0)
+
+        # Lower part of every column, M[j+d,j] = M[j,j+d]
+        for d in range(1, u+1):
+            s[:-d] += a[u-d, d:]
+
+        return np.amax(s)
+
+
+    def _solve_nonneg(self, alpha):
+        """
+        Solves the normal equations for the given value of alpha, subject
+        to x >= 0, starting from the previous solution.
+        """
+        if alpha != self.nonneg_alpha:
+            A = self.normal_GG + alpha**2 * self.normal_DD
+            self.nonneg_x = self._fnnls(A, self.normal_Gb, x0=self.nonneg_x)
+            self.nonneg_alpha = alpha
+
+        return self.nonneg_x.copy()
+
+
+    def _fnnls(self, A, c, x0=None):
+        """
+        Minimizes x^T*A*x/2 - c^T*x subject to x >= 0, where A is the
+        (symmetric positive semi-definite) matrix of the normal equations
+        and c the right-hand side, using the FNNLS algorithm of Bro & de
+        Jong (1997), i.e. the Lawson-Hanson active-set algorithm working
+        on the normal equations directly.
+
+        If 'x0' is given, the passive set (of positive elements) starts
+        as the positive elements of x0, so that only a few elements need
+        to change if the solution is close to x0.
+        """
+        N   = c.size
+        tol = 10 * np.finfo(np.float64).eps * np.linalg.norm(A, 1) * N
+
+        if x0 is None:
+            x = np.zeros((N,))
+        else:
+            x = np.maximum(x0, 0)
+
+        P = x > 0
+        if np.any(P):
+            x, P = self._fnnls_feasible(A, c, x, P, self._solvePassive(A, c, P))
+
+        # Elements which were just moved to the passive set, but which
+        # would be made negative (due to round-off)
+        skip = np.zeros((N,), dtype=bool)
+
+        for _ in range(3*N):
+            w = c - A.dot(x)
+            cand = ~P & ~skip & (w > tol)
+            if not np.any(cand):
+                break
+
+            j = np.argmax(np.where(cand, w, -np.inf))
+            P[j] = True
+
+            s = self._solvePassive(A, c, P)
+            if s[j] <= 0:
+                P[j] = False
+                skip[j] = True
+                continue
+
+            skip[:] = False
+            x, P = self._fnnls_feasible(A, c, x, P, s)
+
+        return x
+
+
+    def _fnnls_feasible(self, A, c, x, P, s):
+        """
+        Inner loop of FNNLS: given a feasible point 'x' and the solution
+        's' of the normal equations restricted to the passive set 'P',
+        moves from x towards s, removing elements from the passive set
+        as they reach zero, until the solution on the passive set is
+        positive.
+        """
+        while True:
+            neg = P & (s <= 0)
+            if not np.any(neg):
+                return s, P
+
+            idx = np.flatnonzero(neg)
+            t = x[idx] / (x[idx] - s[idx])
+            k = np.argmin(t)
+
+            x = x + t[k]*(s-x)
+            x[idx[k]] = 0
+
+            P = P & (x > 0)
+            x[~P] = 0
+
+            s = self._solvePassive(A, c, P)
+
+
+    def _solvePassive(self, A, c, P):
+        """
+        Solves the normal equations restricted to the elements in the
+        passive set P (with all other elements set to zero).
+        """
+        s = np.zeros(c.shape)
+        if not np.any(P):
+            return s
+
+        AP = A[np.ix_(P, P)]
+        try:
+            s[P] = scipy.linalg.cho_solve(scipy.linalg.cho_factor(AP, check_finite=False), c[P], check_finite=False)
+        except np.linalg.LinAlgError:
+            # Singular (e.g. for very small alpha)
+            s[P] = np.linalg.lstsq(AP, c[P], rcond=None)[0]
+
+        return s
+
+
+    def _nonneg_curve(self, alphas):
+        """
+        Evaluates the L-curve (see 'lcurve()') for the non-negative
+        problem by solving it for each alpha. The values of alpha are
+        visited in increasing order, so that each solve starts from the
+        solution for a neighbouring alpha. The effective number of
+        degrees of freedom used for the GCV function is evaluated for the
+        unconstrained problem restricted to the passive set.
+        """
+        res2  = np.zeros(alphas.shape)
+        sol2  = np.zeros(alphas.shape)
+        trace = np.zeros(alphas.shape)
+
+        # For large alpha, the solution approaches the null space of D,
+        # and the computed seminorm || D*x || is eventually only round-off
+        tol = np.sqrt(np.finfo(np.float64).eps) * scipy.sparse.linalg.norm(self.diff_D, 1)
+        resolved = np.zeros(alphas.shape, dtype=bool)
+
+        order = np.argsort(alphas)
+        for i in order:
+            x = self._solve_nonneg(alphas[i])
+            P = x > 0
+
+            Dx = self.diff_D.dot(x)
+            res2[i] = self.normal_bb - 2*x.dot(self.normal_Gb) + x.dot(self.normal_GG.dot(x))
+            sol2[i] = Dx.dot(Dx)
+            resolved[i] = np.sqrt(sol2[i]) > tol * np.linalg.norm(x)
+
+            if np.any(P):
+                GG = self.normal_GG[np.ix_(P, P)]
+                A  = GG + alphas[i]**2 * self.normal_DD[np.ix_(P, P)]
+                trace[i] = np.trace(np.linalg.lstsq(A, GG, rcond=None)[0])
+
+        # Guard against round-off making the residual negative
+        res2 = np.maximum(res2, np.finfo(np.float64).eps * self.normal_bb)
+
+        # The curvature is only evaluated where the seminorm is resolved
+        # (since round-off would otherwise make up the corner)
+        kappa = np.full(alphas.shape, -np.inf)
+        idx = order[resolved[order]]
+        if idx.size >= 3:
+            kappa[idx] = self._curvature(alphas[idx], np.sqrt(res2[idx]), np.sqrt(sol2[idx]))
+
+        return {
+            'alpha': alphas,
+            'residual': np.sqrt(res2),
+            'solution': np.sqrt(sol2),
+            'curvature': kappa,
+            'gcv': res2 / (self.green.shape[1] - trace)**2
+        }
+
+
+    def _residual_normal(self, alpha):
+        """
+        Evaluates the default fitness function (the sum of squared
+        residuals) for the given value of alpha, without forming the
+        synthetic data.
+        """
+        x = self._solve_normal(alpha)
+        GG = self.normal_GGs if self.normal_band is not None else self.normal_GG
+
+        return self.normal_bb - 2*x.dot(self.normal_Gb) + x.dot(GG.dot(x))
+
+
     def _invert_svd_init(self):
         """
         Initializes the SVD method for Tikhonov regularization.
         """
-        self.svd_u, self.svd_s, self.svd_vt = np.linalg.svd(self.green.T, full_matrices=False)
+        if self.rank is None and self.energy is None:
+            # The left singular vectors take up as much memory as the dense
+            # Green's function, and so sparse Green's functions are densified
+            G = self.green.toarray() if self.sparse else self.green
+            self.svd_u, self.svd_s, self.svd_vt = np.linalg.svd(G.T.astype(np.float64, copy=False), full_matrices=False)
+
+            self.svd_rank   = self.svd_s.size
+            self.svd_energy = 1.0
+        else:
+            self._truncated_svd_init()
+
+        # Projection of the data onto the left singular vectors
+        self.svd_beta = self.svd_u.T.dot(self.data)
+        self.svd_bb   = self.data.dot(self.data)
+
+
+    def _truncated_svd_init(self, oversample=10):
+        """
+        Computes the leading singular values (and vectors) of the Green's
+        function, keeping at most 'self.rank' of them, or as few as are
+        needed to account for the fraction 'self.energy' of the squared
+        Frobenius norm of the Green's function. A randomized range finder
+        is used, which samples 'oversample' more vectors than the number
+        of singular values computed. When the rank needed is not known in
+        advance, it is doubled (and the range extended) until enough of
+        the spectrum has been captured.
+        """
+        G = self.green.astype(np.float64, copy=False)
+        N = G.shape[0]
+
+        if self.sparse:
+            total = scipy.sparse.linalg.norm(G)**2
+        else:
+            total = np.linalg.norm(G)**2
+
+        maxrank = N if self.rank is None else min(self.rank, N)
+        k = maxrank if self.energy is None else min(maxrank, 16)
+
+        # Fixed seed, so that the result is reproducible
+        rng = np.random.default_rng(0)
+        Q = np.zeros((G.shape[1], 0))
+
+        while True:
+            if k + oversample >= N:
+                # The range covers all of G^T, so compute the full SVD
+                A = G.toarray() if self.sparse else G
+                U, s, vt = np.linalg.svd(A.T, full_matrices=False)
+                Q = None
+            else:
+                Q = self._extend_range(G, Q, k + oversample - Q.shape[1], rng)
+                U, s, vt = np.linalg.svd(G.dot(Q).T, full_matrices=False)
+
+            keep = k
+            if self.energy is not None:
+                cum = np.cumsum(s[:k]**2) / total if total > 0 else np.ones((k,))
+                if cum[-1] < self.energy and k < maxrank:
+                    k = min(maxrank, 2*k)
+                    continue
+
+                keep = min(int(np.searchsorted(cum, self.energy)) + 1, k)
+
+            break
+
+        # Singular vectors of the projection Q^T * G^T are rotated back
+        if Q is not None:
+            U = Q.dot(U[:,:keep])
+
+        self.svd_u, self.svd_s, self.svd_vt = U[:,:keep], s[:keep], vt[:keep]
+        self.svd_rank   = keep
+        self.svd_energy = np.sum(self.svd_s**2) / total if total > 0 else 1.0
+
+
+    def _extend_range(self, G, Q, l, rng, niter=2):
+        """
+        Extends the orthonormal basis Q of (part of) the range of G^T with
+        'l' vectors, using a randomized range finder with 'niter' power
+        iterations (Halko, Martinsson & Tropp, SIAM Review 53, 217 (2011)).
+        Only products with G and G^T are needed, so that G may be sparse.
+        The new vectors are orthogonal to Q, so that only the part of the
+        range not yet captured is sampled.
+        """
+        Y = G.T.dot(rng.standard_normal((G.shape[0], l)))
+
+        for _ in range(niter):
+            Y = self._orthonormalize(Y, Q)
+            Z, _ = np.linalg.qr(G.dot(Y))
+            Y = G.T.dot(Z)
+
+        return np.hstack((Q, self._orthonormalize(Y, Q)))
+
+
+    def _orthonormalize(self, Y, Q):
+        """
+        Orthonormalizes the columns of Y against each other and against
+        the (orthonormal) columns of Q.
+        """
+        # Project twice for numerical stability
+        for _ in range(2):
+            Y = Y - Q.dot(Q.T.dot(Y))
+
+        Y, _ = np.linalg.qr(Y)
+        return Y
+
+
+    def _svd_filter(self, alpha):
+        """
+        Returns the Tikhonov filter factors s^2 / (s^2 + alpha^2) for
+        the given value of alpha.
+        """
+        s2 = self.svd_s**2
+        return s2 / (s2 + alpha**2)
 
 
     def _invert_svd(self, alpha):
         """
         Solves the linear problem using Tikhonov regularization and
-        SVD decomposition of the linear operator matrix.
-        """
-        s = np.copy(self.svd_s)
-        f = s**2 / (s**2 + alpha**2)
-        s = np.divide(1, s, where=(s>0))
-        s = s*f
+        SVD decomposition of the linear operator matrix. The solution is
+        given by
+
+          x = sum_i f_i * (u_i^T b) / s_i * v_i
 
-        pinv = np.matmul(self.svd_vt.T, np.multiply(s[...,np.newaxis], self.svd_u.T))
+        where f_i are the Tikhonov filter factors.
+        """
+        f = self._svd_filter(alpha)
+        s = np.divide(f, self.svd_s, out=np.zeros(f.shape), where=(self.svd_s>0))
 
-        x   = pinv.dot(self.data)
-        img = self.green.T.dot(x)
+        x   = self.svd_vt.T.dot(s * self.svd_beta)
+        img = self._forward(x)
 
         return x, img
 
 
+    def _residual_svd(self, alpha):
+        """
+        Evaluates the default fitness function (the sum of squared
+        residuals) for the given value of alpha in closed form, i.e.
+
+          || b - A*x ||^2 = || b ||^2 - || U^T b ||^2 + sum_i ((1-f_i) * u_i^T b)^2
+        """
+        f = self._svd_filter(alpha)
+        return self.svd_bb - self.svd_beta.dot(self.svd_beta) + np.sum(((1-f)*self.svd_beta)**2)
+
+
+def _gramBlocks(green, data, blocks):
+    """
+    Accumulates G*G^T and G*b in double precision over the given blocks
+    of a Green's function which is evaluated block by block.
+    """
+    N = green.shape[0]
+    GG = np.zeros((N, N))
+    Gb = np.zeros((N,))
+
+    for k in blocks:
+        cols, g = green.block(k)
+        if scipy.sparse.issparse(g):
+            g = g.astype(np.float64)
+            GG += g.dot(g.T).toarray()
+        else:
+            g = np.asarray(g, dtype=np.float64)
+            GG += g.dot(g.T)
+
+        Gb += g.dot(data[cols])
+
+    return GG, Gb
+
+
@@ -0,0 +1,178 @@
+"""
+On-disk cache of filtered videos. The filtered frames are stored in HDF5
+files in a cache directory, identified by a hash of the contents of the
+raw video file, the type of the frames and the classes and parameters of
+the filters applied.
+
+Since hashing a large video file takes time, the hash of every file is
+stored in an index in the cache directory, together with the size and
+modification time of the file. The file is only hashed again if either
+of these change.
+"""
+
+import h5py
+import hashlib
+import json
+import numpy as np
+import os
+
+from .InverterException import InverterException
+
+
+class FilterCache:
+
+
+    # Name of the index of video file hashes in the cache directory
+    INDEXFILE = 'hashes.json'
+
+
+    def __init__(self, directory):
+        """
+        Constructor.
+
+        directory: Directory in which to store filtered videos (created
+                   if it does not exist).
+        """
+        self.directory = directory
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            raise InverterException("Unable to create filter cache directory '{0}': {1}".format(self.directory, e))
+
+
+    def load(self, filename, filters, dtype):
+        """
+        Returns the frames of the named video filtered with the given
+        list of filters, or 'None' if they are not in the cache.
+        """
+        path = self._path(self.key(filename, filters, dtype))
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with h5py.File(path, 'r') as f:
+                return f['frames'][:]
+        except (OSError, KeyError):
+            # Incomplete or corrupt file; it is replaced when the
+            # filtered frames are stored again
+            return None
+
+
+    def store(self, filename, filters, dtype, frames):
+        """
+        Stores the frames of the named video filtered with the given
+        list of filters in the cache.
+        """
+        path = self._path(self.key(filename, filters, dtype))
+        tmp  = '{0}.{1}.tmp'.format(path, os.getpid())
+
+        with h5py.File(tmp, 'w') as f:
+            f['frames'] = frames
+            f['frames'].attrs['source'] = os.path.abspath(filename)
+            f['frames'].attrs['filters'] = json.dumps(self._describe(filters))
+
+        # Replace atomically, so that other processes never see a
+        # partially written file
+        os.replace(tmp, path)
+
+
+    def clear(self):
+        """
+        Removes all filtered videos (and the index of file hashes) from
+        the cache.
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith('.h5') or name == self.INDEXFILE:
+                os.remove(os.path.join(self.directory, name))
+
+
+    def key(self, filename, filters, dtype):
+        """
+        Returns the key identifying the named video filtered with the
+        given list of filters.
+        """
+        desc = {
+            'file': self.fileHash(filename),
+            'dtype': np.dtype(dtype).str,
+            'filters': self._describe(filters)
+        }
+
+        s = json.dumps(desc, sort_keys=True)
+        return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+
+    def fileHash(self, filename):
+        """
+        Returns the SHA-256 hash of the contents of the named file. The
+        hash is looked up in the index if the file has not changed since
+        it was last hashed.
+        """
+        st = os.stat(filename)
+        name = os.path.abspath(filename)
+
+        index = self._loadIndex()
+        if name in index:
+            e = index[name]
+            if e['size'] == st.st_size and e['mtime'] == st.st_mtime_ns:
+                return e['sha256']
+
+        h = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 24), b''):
+                h.update(chunk)
+
+        # Re-read the index in case it was updated in the meantime
+        index = self._loadIndex()
+        index[name] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': h.hexdigest()}
+        self._saveIndex(index)
+
+        return h.hexdigest()
+
+
+    def _describe(self, filters):
+        """
+        Returns a JSON-serializable description of the given list of
+        filters, consisting of the class and parameters of each filter.
+        """
+        desc = []
+        for f in filters:
+            d = {
+                'class': '{0}.{1}'.format(type(f).__module__, type(f).__qualname__),
+                'parameters': f.parameters()
+            }
+
+            if hasattr(f, 'filters'):
+                d['filters'] = self._describe(f.filters)
+
+            desc.append(d)
+
+        return desc
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, key+'.h5')
+
+
+    def _loadIndex(self):
+        path = os.path.join(self.directory, self.INDEXFILE)
+        if not os.path.isfile(path):
+            return dict()
+
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return dict()
+
+
+    def _saveIndex(self, index):
+        path = os.path.join(self.directory, self.INDEXFILE)
+        tmp  = '{0}.{1}.tmp'.format(path, os.getpid())
+
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+
+        os.replace(tmp, path)
+
+
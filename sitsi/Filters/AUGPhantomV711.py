@@ -8,6 +8,10 @@ from . RemoveArtifacts import RemoveArtifacts
 class AUGPhantomV711(Filter):
     
 
+    # All filters of the chain can be applied in place
+    inplace = True
+
+
     def __init__(self):
         """
         Constructor.
@@ -17,15 +21,12 @@ class AUGPhantomV711(Filter):
         self.filters.append(HXRFilter())
 
 
-    def apply(self, times, data):
+    def apply(self, times, data, out=None):
         """
         Filters the raw video data so as to remove the noise
-        found in ASDEX-U Phantom V711 camera images.
+        found in ASDEX-U Phantom V711 camera images. The result is
+        written to 'out' if given (which may be 'data' itself).
         """
-        d = np.copy(data)
-        for f in self.filters:
-            d = f.apply(times=times, data=d)
-
-        return d
+        return Filter.applyChain(self.filters, times, data, out=out)
 
 
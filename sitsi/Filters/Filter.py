@@ -1,19 +1,135 @@
 # General image filter base class
 
 
+import concurrent.futures
+import copy
 import numpy as np
-from .. Video import Video
 
 
 class Filter:
     
 
+    # Number of frames before and after a block of frames which this
+    # filter needs to see in order to filter the block correctly (used
+    # when filtering a video block by block)
+    halo = 0
+
+    # Whether or not this filter depends on properties of the full video,
+    # which must be computed by 'prepare()' before filtering a video block
+    # by block
+    prepass = False
+
+    # Whether or not 'apply()' accepts an 'out' argument, in which case
+    # the filtered data is written to the given array (which may be the
+    # input array itself, i.e. the filter can be applied in place)
+    inplace = False
+
+    # How the work of an in-place filter can be divided between several
+    # workers: 'frames' if every frame can be filtered independently
+    # (after the pre-pass, if any), 'pixels' if every pixel (i.e. every
+    # row of pixels in all frames) can be filtered independently, and
+    # 'None' if the filter cannot be split
+    split = None
+
+
     def __init__(self):
         """
         Constructor.
         """
         pass
 
+
+    @staticmethod
+    def applyChain(filters, times, data, out=None, nworkers=1, executor=None):
+        """
+        Applies the given list of filters in sequence. Filters which can
+        be applied in place all write to the same array, 'out', which is
+        allocated if not given (pass 'out=data' to filter 'data' in
+        place). The input array is otherwise left untouched (filters
+        which are not in place are given a copy of it, since they may
+        modify their input).
+
+        If 'nworkers' is greater than one, the work of filters which can
+        be split (see 'split') is divided between a pool of threads. Any
+        filters which need a pre-pass are then prepared with the full
+        input data (using copies of the filters, so that the given filter
+        objects are not modified). The result is the same as when
+        filtering serially.
+
+        Returns the filtered data (which is stored in 'out' unless the
+        last filter of the chain does not support in-place operation).
+        """
+        if nworkers > 1 and executor is None:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nworkers) as ex:
+                return Filter.applyChain(filters, times, data, out=out, nworkers=nworkers, executor=ex)
+
+        inp = data
+
+        # The input may only be modified if it is also the output
+        writable = out is not None and np.may_share_memory(out, inp)
+
+        for f in filters:
+            if f.inplace:
+                if out is None:
+                    out = np.empty_like(inp)
+
+                if executor is None:
+                    data = f.apply(times, data, out=out)
+                elif hasattr(f, 'filters'):
+                    data = Filter.applyChain(f.filters, times, data, out=out, nworkers=nworkers, executor=executor)
+                else:
+                    data = Filter._applySplit(f, times, data, out, nworkers, executor)
+            else:
+                if not writable and np.may_share_memory(data, inp):
+                    data = np.copy(data)
+
+                data = f.apply(times, data)
+
+                # Reuse the new array as output of the following filters
+                if out is None and not np.may_share_memory(data, inp):
+                    out = data
+
+        return data
+
+
+    @staticmethod
+    def _applySplit(f, times, data, out, nworkers, executor):
+        """
+        Applies the in-place filter 'f' to parts of the data in parallel,
+        with the parts (blocks of frames or rows of pixels, depending on
+        'f.split') distributed over 'nworkers' threads of the given
+        executor.
+        """
+        if f.split == 'frames':
+            axis = 0
+        elif f.split == 'pixels' and data.ndim > 1:
+            axis = 1
+        else:
+            return f.apply(times, data, out=out)
+
+        times = np.asarray(times)
+
+        # Properties of the full video must be computed before the
+        # frames are split up. They are kept by a copy of the filter, since
+        # the filter object may be shared (e.g. with a 'VideoStream').
+        if f.prepass and axis == 0:
+            f = copy.copy(f)
+            f.prepare([(times, data)])
+
+        jobs = []
+        for idx in np.array_split(np.arange(data.shape[axis]), nworkers):
+            if idx.size == 0:
+                continue
+
+            s = (slice(None),)*axis + (slice(idx[0], idx[-1]+1),)
+            t = times[s[0]]
+            jobs.append(executor.submit(f.apply, t, data[s], out=out[s]))
+
+        for job in jobs:
+            job.result()
+
+        return out
+
     
     def apply(self, times, data):
         """
@@ -27,3 +143,36 @@ class Filter:
         return self.frames
 
 
+    def parameters(self):
+        """
+        Returns a dictionary of the parameters which determine the
+        result of this filter (used to identify cached results). By
+        default, all attributes which are numbers, booleans or strings
+        are included.
+        """
+        params = dict()
+        for key, val in vars(self).items():
+            if isinstance(val, (bool, int, float, str, np.number, np.bool_)):
+                params[key] = val.item() if isinstance(val, np.generic) else val
+
+        return params
+
+
+    def prepare(self, blocks):
+        """
+        Called before a video is filtered block by block (if 'prepass' is
+        'True'), with an iterator over tuples (times, data) of consecutive
+        blocks of the input to this filter. Filters which depend on
+        properties of the full video (such as the time average) should
+        compute them here.
+        """
+        pass
+
+
+    def release(self):
+        """
+        Forget any properties computed by 'prepare()'.
+        """
+        pass
+
+
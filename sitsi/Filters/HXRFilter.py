@@ -12,27 +12,79 @@ from . Filter import Filter
 class HXRFilter(Filter):
     
     
-    def __init__(self, threshold=0.9):
+    # The result can be written directly to the output array
+    inplace = True
+
+    # Every pixel is filtered independently
+    split = 'pixels'
+
+
+    def __init__(self, threshold=0.9, halo=16, tilesize=2**22):
         """
         Constructor.
 
         threshold: Relative amount by which a pixel must briefly change in the
                    video to be considered a HXR anomaly.
+        halo:      Number of neighbouring frames to include on either side
+                   of a block of frames when filtering a video block by
+                   block. The result is exact as long as no pixel is
+                   anomalous in more than 'halo-2' consecutive frames.
+        tilesize:  Approximate number of elements in each tile of pixels
+                   (with all frames) which is filtered at a time. This
+                   limits the size of the temporary arrays used.
         """
         self.threshold = threshold
+        self.halo      = halo
+        self.tilesize  = tilesize
+
+
+    def apply(self, times, data, out=None):
+        """
+        Apply this filter. The result is written to 'out' if given (which
+        may be 'data' itself).
+
+        Every pixel is filtered independently, and so the video is
+        processed in tiles consisting of a number of rows of pixels.
+        """
+        times = np.asarray(times)
 
+        if out is None:
+            out = np.empty_like(data)
 
-    def apply(self, times, data):
+        for tile in self._tiles(data.shape):
+            self._applyTile(times, data[tile], out[tile])
+
+        return out
+
+
+    def parameters(self):
+        """
+        The halo and the tile size do not affect the result of this
+        filter when it is applied to a full video.
         """
-        Apply this filter.
+        return {'threshold': self.threshold}
+
+
+    def _tiles(self, shape):
         """
-        pixels = data.shape[1:]
+        Returns a list of indices selecting tiles of rows of pixels (in
+        all frames) of an array with the given shape.
+        """
+        if len(shape) < 2:
+            return [(slice(None),)]
+
+        rowsize = int(np.prod(shape)) // max(1, shape[1])
+        nrows   = max(1, self.tilesize // max(1, rowsize))
 
-        # Average in time over all pixels in the image
-        time_median = np.zeros(data.shape)
-        for i in range(pixels[0]):
-            for j in range(pixels[1]):
-                time_median[:,i,j] = scipy.ndimage.median_filter(data[:,i,j], size=3)
+        return [(slice(None), slice(i, i+nrows)) for i in range(0, shape[1], nrows)]
+
+
+    def _applyTile(self, times, data, out):
+        """
+        Filter a tile of the video, writing the result to 'out'.
+        """
+        # Median in time of every pixel in the image
+        time_median = scipy.ndimage.median_filter(data, size=(3,)+(1,)*(data.ndim-1))
 
         # Ignore divide-by-zero for a bit
         errs = np.geterr()
@@ -54,17 +106,61 @@ class HXRFilter(Filter):
         tfilter[1:-1] = (tf_forward[:-1] < self.threshold) & (tf_backward[1:] < self.threshold)
 
         # Interpolate anomalous pixels
-        sframes = np.copy(data)
-        for i in range(pixels[0]):
-            for j in range(pixels[1]):
-                tslice   = np.copy(data[:,i,j])
-                tf_slice = tfilter[:,i,j]
-
-                # In every time point where this pixel is anomalously bright,
-                # we interpolate its value based on its previous and next (in time) value
-                tslice[tf_slice] = np.interp(times[tf_slice], times[~tf_slice], tslice[~tf_slice])
-                sframes[:,i,j] = tslice
-
-        return sframes
+        self._interpolate(times, data, tfilter, out)
+
+
+    def _interpolate(self, times, data, tfilter, out):
+        """
+        In every time point where a pixel is anomalously bright, we
+        interpolate its value linearly based on its previous and next (in
+        time) non-anomalous value. This gives the same result as calling
+        'np.interp' on the time trace of every pixel, but is done for all
+        pixels at once. The result is written to 'out' (which may be
+        'data' itself).
+        """
+        nt = data.shape[0]
+        itype = np.int32 if nt < np.iinfo(np.int32).max else np.int64
+        it = np.arange(nt, dtype=itype).reshape((nt,) + (1,)*(data.ndim-1))
+
+        # Index of previous and next non-anomalous time point
+        prev = np.where(tfilter, itype(-1), it)
+        np.maximum.accumulate(prev, axis=0, out=prev)
+        nxt = np.where(tfilter, itype(nt), it)
+        nxt = np.flip(np.minimum.accumulate(np.flip(nxt, axis=0), axis=0), axis=0)
+
+        # Outside the range of non-anomalous points, the value of the
+        # closest such point is used (as with 'np.interp'). Pixels which
+        # are anomalous in all time points are left untouched.
+        idx = np.nonzero(tfilter & (prev[-1] >= 0))
+        rest = idx[1:]
+        i0 = prev[idx]
+        i1 = nxt[idx]
+        i0, i1 = np.where(i0 >= 0, i0, i1), np.where(i1 < nt, i1, i0)
+
+        fp0 = data[(i0,)+rest].astype(np.float64)
+        fp1 = data[(i1,)+rest].astype(np.float64)
+        xp0 = times[i0]
+        xp1 = times[i1]
+        x   = times[idx[0]]
+
+        # Same arithmetic as in 'np.interp'
+        errs = np.geterr()
+        np.seterr(divide='ignore', invalid='ignore')
+
+        slope = (fp1 - fp0) / (xp1 - xp0)
+        v = slope*(x - xp0) + fp0
+
+        # If we get nan in one direction, try the other
+        isnan = np.isnan(v)
+        v[isnan] = slope[isnan]*(x[isnan] - xp1[isnan]) + fp1[isnan]
+        isnan &= np.isnan(v) & (fp0 == fp1)
+        v[isnan] = fp0[isnan]
+
+        np.seterr(**errs)
+
+        if not np.may_share_memory(out, data):
+            out[...] = data
+
+        out[idx] = np.where(i0 == i1, fp0, v)
 
 
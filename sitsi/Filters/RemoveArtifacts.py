@@ -13,17 +13,56 @@ from . Filter import Filter
 
 class RemoveArtifacts(Filter):
     
+
+    # The time average of the full video is needed
+    prepass = True
+
+    # The result can be written directly to the output array
+    inplace = True
+
+    # Frames are filtered independently once the mean is known
+    split = 'frames'
+    
     
     def __init__(self, sigma=0.8):
         self.sigma = sigma
+        self.mean  = None
 
 
-    def apply(self, times, data):
+    def apply(self, times, data, out=None):
         """
-        Apply this filter.
+        Apply this filter. The result is written to 'out' if given (which
+        may be 'data' itself).
         """
-        mean       = np.mean(data, axis=0)
+        if self.mean is None:
+            mean = np.mean(data, axis=0)
+        else:
+            mean = self.mean
+
         smoothed   = scipy.ndimage.gaussian_filter(mean, self.sigma)
 
-        return data * (smoothed/mean)
+        return np.multiply(data, smoothed/mean, out=out)
+
+
+    def prepare(self, blocks):
+        """
+        Compute the time average of a video which is given block by block.
+        The frames are summed in the same order as in 'np.mean()'.
+        """
+        total = None
+        n = 0
+        for _, data in blocks:
+            if total is None:
+                total = np.zeros(data.shape[1:], dtype=data.dtype)
+
+            for frame in data:
+                total += frame
+
+            n += data.shape[0]
+
+        self.mean = total / total.dtype.type(n)
+
+
+    def release(self):
+        self.mean = None
 
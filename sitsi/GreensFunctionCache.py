@@ -0,0 +1,150 @@
+"""
+Least-recently-used cache of opened Green's function files and of the
+slices which have been read from them. Slices are kept in memory as long
+as their total size does not exceed a given budget (in bytes).
+"""
+
+import collections
+import h5py
+import os
+
+
+class GreensFunctionCache:
+
+
+    def __init__(self, maxbytes=0, maxfiles=16):
+        """
+        Constructor.
+
+        maxbytes: Maximum number of bytes of Green's function data to keep
+                  in memory. A value of 0 disables caching of slices.
+        maxfiles: Maximum number of files to keep open simultaneously.
+        """
+        self.maxbytes = maxbytes
+        self.maxfiles = maxfiles
+
+        self.files  = collections.OrderedDict()
+        self.slices = collections.OrderedDict()
+        self.nbytes = 0
+
+        self.hits   = 0
+        self.misses = 0
+
+        # File handles can not be shared with forked processes, so we
+        # keep track of which process opened them
+        self.pid = os.getpid()
+
+
+    def __getstate__(self):
+        """
+        Open files and cached data are not transferred when pickling
+        (e.g. when sending the Green's function to worker processes).
+        """
+        state = self.__dict__.copy()
+        state['files']  = collections.OrderedDict()
+        state['slices'] = collections.OrderedDict()
+        state['nbytes'] = 0
+
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pid = os.getpid()
+
+
+    def clear(self):
+        """
+        Close all open files and remove all cached slices.
+        """
+        for fh in self.files.values():
+            fh.close()
+
+        self.files  = collections.OrderedDict()
+        self.slices = collections.OrderedDict()
+        self.nbytes = 0
+
+
+    def getFile(self, filename):
+        """
+        Returns an open handle to the named HDF5 file.
+        """
+        self._checkProcess()
+
+        if filename in self.files:
+            self.files.move_to_end(filename)
+            return self.files[filename]
+
+        fh = h5py.File(filename, 'r')
+        self.files[filename] = fh
+
+        while len(self.files) > self.maxfiles:
+            _, f = self.files.popitem(last=False)
+            f.close()
+
+        return fh
+
+
+    def getSlice(self, key):
+        """
+        Returns the cached slice with the given key, or 'None' if the
+        slice is not in the cache.
+        """
+        self._checkProcess()
+
+        if key in self.slices:
+            self.slices.move_to_end(key)
+            self.hits += 1
+            return self.slices[key]
+        else:
+            self.misses += 1
+            return None
+
+
+    def putSlice(self, key, data):
+        """
+        Adds the given slice to the cache, evicting the least recently
+        used slices until the cache fits within its memory budget. The
+        cached array is made read-only, since it is shared between all
+        callers requesting the same slice.
+        """
+        if data.nbytes > self.maxbytes:
+            return
+
+        if key in self.slices:
+            self.nbytes -= self.slices.pop(key).nbytes
+
+        while self.nbytes + data.nbytes > self.maxbytes:
+            _, d = self.slices.popitem(last=False)
+            self.nbytes -= d.nbytes
+
+        data.flags.writeable = False
+        self.slices[key] = data
+        self.nbytes += data.nbytes
+
+
+    def info(self):
+        """
+        Returns a dict with statistics about the cache.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'slices': len(self.slices),
+            'files': len(self.files),
+            'nbytes': self.nbytes,
+            'maxbytes': self.maxbytes
+        }
+
+
+    def _checkProcess(self):
+        """
+        Drop all handles opened by a parent process after a fork.
+        """
+        if self.pid != os.getpid():
+            self.files  = collections.OrderedDict()
+            self.slices = collections.OrderedDict()
+            self.nbytes = 0
+            self.pid    = os.getpid()
+
+
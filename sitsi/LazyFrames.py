@@ -0,0 +1,145 @@
+"""
+Array-like access to the frames of a video stored in an HDF5 file, which
+reads (and filters) frames only when they are accessed. Frames are read in
+blocks, and the most recently used blocks are kept in memory.
+"""
+
+import collections
+import numpy as np
+
+from .InverterException import InverterException
+
+
+class LazyFrames:
+
+
+    def __init__(self, stream, indices=None, cachesize=16):
+        """
+        Constructor.
+
+        stream:    'VideoStream' object used to read (and filter) frames.
+        indices:   Indices of the frames in the file corresponding to
+                   the frames of this object (by default all frames).
+        cachesize: Maximum number of blocks of frames to keep in memory.
+        """
+        self.stream    = stream
+        self.cachesize = cachesize
+        self.blocks    = collections.OrderedDict()
+
+        if indices is None:
+            self.indices = np.arange(stream.nframes)
+        else:
+            self.indices = np.asarray(indices)
+
+
+    def __len__(self):
+        return self.indices.size
+
+
+    def __getitem__(self, index):
+        """
+        Returns the frame with the given index, or an array of frames if
+        the index is a slice or a list of indices.
+        """
+        idx = self.indices[index]
+
+        if np.ndim(idx) == 0:
+            return self._getFrame(int(idx))
+        else:
+            frames = np.zeros((idx.size,) + self.shape[1:], dtype=self.stream.dtype)
+            for i in range(idx.size):
+                frames[i] = self._getFrame(int(idx[i]))
+
+            return frames
+
+
+    def __array__(self, dtype=None, copy=None):
+        """
+        Reads all frames into an array.
+        """
+        if dtype is None:
+            return self[:]
+        else:
+            return self[:].astype(dtype)
+
+
+    @property
+    def shape(self):
+        return (self.indices.size,) + self.stream.frameshape
+
+
+    @property
+    def ndim(self):
+        return 3
+
+
+    def take(self, indices):
+        """
+        Returns a new 'LazyFrames' object consisting of the frames with
+        the given indices (without reading any frames).
+        """
+        lf = LazyFrames(self.stream, indices=self.indices[indices], cachesize=self.cachesize)
+        lf.blocks = self.blocks
+
+        return lf
+
+
+    def max(self):
+        """
+        Returns the maximum value of all frames, reading the frames block
+        by block.
+        """
+        if self.indices.size == 0:
+            raise InverterException("Unable to compute maximum of empty video.")
+
+        bs = self.stream.blocksize
+        blocks = np.unique(self.indices // bs)
+
+        m = None
+        for b in blocks:
+            local = self.indices[(self.indices // bs) == b] - b*bs
+            v = np.amax(self._getBlock(b)[local])
+            m = v if m is None else max(m, v)
+
+        return m
+
+
+    def close(self):
+        """
+        Release the blocks cached and properties computed by the filters,
+        and close the video file.
+        """
+        self.blocks.clear()
+        self.stream.release()
+        self.stream.close()
+
+
+    def _getFrame(self, index):
+        """
+        Returns the frame with the given index in the file.
+        """
+        bs = self.stream.blocksize
+        return self._getBlock(index // bs)[index % bs]
+
+
+    def _getBlock(self, block):
+        """
+        Returns the block with the given index, reading it from the
+        file if it is not in the cache.
+        """
+        if block in self.blocks:
+            self.blocks.move_to_end(block)
+            return self.blocks[block]
+
+        self.stream.prepare()
+
+        bs = self.stream.blocksize
+        data = self.stream.read(block*bs, min((block+1)*bs, self.stream.nframes))
+
+        self.blocks[block] = data
+        while len(self.blocks) > self.cachesize:
+            self.blocks.popitem(last=False)
+
+        return data
+
+
@@ -13,19 +13,31 @@ distribution function.
 """
 
 import numpy as np
+import scipy.sparse
 from .. InverterException import InverterException
+from . PixelBlocks import PixelBlocks
 
 
 class DeltaPExpPitch:
     
 
-    def __init__(self, green):
+    def __init__(self, green, dtype=None, sparse=False):
         """
         Constructor.
 
         green: Green's function to use for evaluating this model.
+        dtype: Floating-point type of the evaluated Green's functions. By
+               default, the type of the input Green's function is used
+               (or double precision if it is not a floating-point type).
+        sparse: If 'True', the evaluated Green's functions are returned as
+                'scipy.sparse' CSR matrices, with the first dimension kept
+                and the remaining dimensions (e.g. the pixels) flattened.
+                Since most combinations of parameters only contribute to a
+                few pixels, this saves a lot of memory.
         """
-        self.green = green
+        self.green  = green
+        self.dtype  = None if dtype is None else np.dtype(dtype)
+        self.sparse = sparse
 
         self.pitchidx, self.xi = self._findPitchDimension()
 
@@ -37,32 +49,127 @@ class DeltaPExpPitch:
         """
         if np.asarray(p).size != 1 or np.asarray(C).size != 1:
             raise InverterException("p and C must be scalars.")
-    
-        pi = self.green.getParameterIndex(p, '1')
 
-        # Delta in p (just get the particular slice of the Green's function)
-        gf = self.green.get(p1=pi)
+        return self.evalBatch(p, C)[0]
+
+
+    def evalBatch(self, p, C, rows=None):
+        """
+        Evaluates this model with the given scalar parameter p, for each of
+        the values in the array C. The Green's function slice corresponding
+        to p is only loaded once. Returns an array whose first dimension
+        corresponds to the elements of C, and whose remaining dimensions
+        are the same as for the Green's function returned by 'eval()'.
+        If the model is sparse, a list of sparse matrices is returned.
+
+        rows: If given, the model is only evaluated for this slice of
+              rows of pixels (the 'i' dimension of the Green's function),
+              and only that part of the Green's function is read.
+        """
+        if self.sparse:
+            return list(self.evalIter(p, C, rows=rows))
+
+        gf, f, pitchidx = self._prepare(p, C, rows=rows)
+        return self._contract(gf, f, pitchidx)
+
+
+    def evalIter(self, p, C, rows=None):
+        """
+        Evaluates this model with the given scalar parameter p, for each of
+        the values in the array C, yielding one Green's function at a time
+        (in the same form as the elements of the result of 'evalBatch()').
+        The Green's function slice corresponding to p is only loaded once,
+        while only one evaluated Green's function exists at a time.
+        """
+        gf, f, pitchidx = self._prepare(p, C, rows=rows)
+
+        for k in range(f.shape[0]):
+            g = self._contract(gf, f[k:k+1], pitchidx)[0]
+
+            if self.sparse:
+                yield scipy.sparse.csr_matrix(g.reshape((g.shape[0], -1)))
+            else:
+                yield g
+
+
+    def _prepare(self, p, C, rows=None):
+        """
+        Loads the Green's function slice corresponding to p, and evaluates
+        the pitch distribution for each of the values in C. Returns the
+        slice, the distributions (as rows) and the index of the pitch
+        dimension in the slice.
+        """
+        if np.asarray(p).size != 1:
+            raise InverterException("p must be a scalar.")
+
+        C = np.atleast_1d(np.asarray(C, dtype=np.float64))
+        if C.ndim != 1:
+            raise InverterException("C must be a scalar or a one-dimensional array.")
+
+        gf, pitchidx = self._loadSlice(p, rows=rows)
+
+        dtype = self.dtype
+        if dtype is None:
+            dtype = gf.dtype if np.issubdtype(gf.dtype, np.floating) else np.dtype(np.double)
 
         # Evaluate just distribution function
-        f = np.exp(C*self.xi) / np.exp(C) * C
+        f = np.exp(np.outer(C, self.xi)) / np.exp(C)[:,np.newaxis] * C[:,np.newaxis]
+
+        return gf.astype(dtype, copy=False), f.astype(dtype), pitchidx
+
+
+    def blocks(self, p, C, rows=16):
+        """
+        Returns a 'PixelBlocks' object which evaluates this model for the
+        given (scalar) parameters p and C, one block of 'rows' rows of
+        pixels at a time.
+        """
+        return PixelBlocks(self, p, C, rows=rows)
 
-        # Multiply with exponential function (pitch distribution)
-        s = [slice(None),] * gf.ndim
-        G = 0
-        for i in range(len(self.xi)):
-            s[self.pitchidx] = i
-            G += gf[tuple(s)] * f[i]
+
+    def _loadSlice(self, p, rows=None):
+        """
+        Loads the slice of the Green's function corresponding to the
+        momentum p (and optionally to the given slice of rows of pixels),
+        with the p dimension removed. Returns the slice and the index of
+        the pitch dimension in it.
+        """
+        pi = self.green.getParameterIndex(p, '1')
+
+        # Delta in p (just get the particular slice of the Green's function,
+        # keeping the p dimension so that it can be removed below)
+        gf = self.green.get(p1=slice(pi, pi+1), i=rows)
 
         # Remove p dimension
         pdim = self.green.format.find('1')
-        if pdim > self.green.format.find('2'):
-            pdim -= 1
-
-        s = [slice(None),] * G.ndim
+        s = [slice(None),] * gf.ndim
         s[pdim] = 0
-        G = G[tuple(s)]
+        gf = gf[tuple(s)]
+
+        pitchidx = self.pitchidx
+        if pdim < pitchidx:
+            pitchidx -= 1
 
-        return G
+        return gf, pitchidx
+
+
+    def _contract(self, gf, f, pitchidx):
+        """
+        Contracts the pitch dimension of the Green's function slice 'gf'
+        with each of the pitch distributions in the rows of 'f'.
+        """
+        shape = gf.shape
+        nbefore = int(np.prod(shape[:pitchidx]))
+        nafter  = int(np.prod(shape[pitchidx+1:]))
+
+        # Multiply with exponential function (pitch distribution). Viewing
+        # the Green's function as a stack of (pitch x rest) matrices, the
+        # contraction becomes a single batched matrix product.
+        g = gf.reshape((nbefore, shape[pitchidx], nafter))
+        G = np.matmul(f, g)
+
+        G = np.moveaxis(G, 1, 0)
+        return G.reshape((f.shape[0],) + shape[:pitchidx] + shape[pitchidx+1:])
 
 
     def _findPitchDimension(self):
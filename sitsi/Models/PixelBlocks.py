@@ -0,0 +1,71 @@
+"""
+A model evaluated block by block, where every block consists of a number of
+rows of pixels of the camera image. Only the part of the Green's function
+needed for one block is read from disk and evaluated at a time, so that
+Green's functions which are too large to fit in memory can be inverted
+(see 'Tikhonov').
+"""
+
+from .. InverterException import InverterException
+
+
+class PixelBlocks:
+
+
+    def __init__(self, model, p, C, rows=16):
+        """
+        Constructor.
+
+        model: Model to evaluate (e.g. a 'DeltaPExpPitch' object). The
+               evaluated Green's function must have the format '?ij',
+               i.e. one dimension (e.g. the radius) followed by the
+               rows and columns of pixels.
+        p:     Value of the model parameter p* to evaluate the model for.
+        C:     Value of the model parameter C to evaluate the model for.
+        rows:  Number of rows of pixels in each block.
+        """
+        self.model = model
+        self.p     = p
+        self.C     = C
+        self.rows  = rows
+
+        if self.rows < 1:
+            raise InverterException("The number of rows in each block must be positive.")
+
+        green = model.green
+        pitch = green.format[model.pitchidx]
+        fmt = ''.join([c for c in green.format if c not in ['1', pitch]])
+
+        if fmt[1:] != 'ij':
+            raise InverterException("Block-wise evaluation requires a Green's function with pixels in its last two dimensions, not '{}'.".format(fmt))
+
+        if green.pixels[0] == 0 or green.pixels[1] == 0:
+            raise InverterException("The number of pixels of the Green's function is not known.")
+
+        params = {'r': green.r, '1': green.p1, '2': green.p2, 'w': green.w}
+
+        self.nrows, self.rowsize = green.pixels
+        self.shape = (params[fmt[0]].size, self.nrows*self.rowsize)
+        self.nblocks = -(-self.nrows // self.rows)
+
+
+    def __len__(self):
+        return self.nblocks
+
+
+    def block(self, k):
+        """
+        Evaluates the model for block 'k'. Returns the columns (pixels)
+        of the full Green's function in the block, as a slice, and the
+        Green's function for those pixels, as an (N, pixels) matrix.
+        """
+        start = k*self.rows
+        end   = min(start+self.rows, self.nrows)
+
+        G = self.model.evalBatch(self.p, self.C, rows=slice(start, end))[0]
+        if G.ndim > 2:
+            G = G.reshape((G.shape[0], -1))
+
+        return slice(start*self.rowsize, end*self.rowsize), G
+
+
@@ -1,2 +1,3 @@
 
 from . DeltaPExpPitch import DeltaPExpPitch
+from . PixelBlocks import PixelBlocks
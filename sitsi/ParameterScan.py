@@ -0,0 +1,163 @@
+"""
+Scan over the free parameters (p*, C) of the 'DeltaPExpPitch' model,
+inverting the given data for the radial profile at every point of the
+(p*, C) grid using Tikhonov regularization.
+
+The work is grouped so that every Green's function slice (corresponding to
+one value of p*) is loaded once per task, and tasks are distributed over a
+pool of worker processes.
+"""
+
+import concurrent.futures
+import numpy as np
+import os
+import scipy.sparse
+
+from . Algorithms.Tikhonov import Tikhonov
+from . InputData import InputData
+from . InverterException import InverterException
+
+
+class ParameterScan:
+
+
+    def __init__(self, model, data, p, C, method='standard', fitness=None, nprocs=None, solver='lstsq', nonneg=False):
+        """
+        Constructor.
+
+        model:   Model to evaluate (e.g. a 'DeltaPExpPitch' object). The
+                 first dimension of the Green's function returned by the
+                 model is taken to be the radial dimension.
+        data:    Data to invert (either an array or an 'InputData' object).
+        p:       List of values of p* to scan.
+        C:       List of values of C to scan.
+        method:  Tikhonov method to use (see 'Tikhonov').
+        fitness: Fitness function to pass on to 'Tikhonov'. Since the
+                 function is sent to the worker processes, it must be
+                 picklable if the processes are not forked.
+        nprocs:  Number of worker processes to use. If 'None', the number
+                 of CPUs of the machine is used.
+        solver:  Linear solver to pass on to 'Tikhonov' (a solver other
+                 than 'lstsq' must be used if the model is sparse).
+        nonneg:  If 'True', the radial profiles are constrained to be
+                 non-negative (requires the 'normal' solver).
+        """
+        if isinstance(data, InputData):
+            data = data.get()
+
+        self.model   = model
+        self.data    = np.ravel(data)
+        self.p       = np.atleast_1d(p)
+        self.C       = np.atleast_1d(C)
+        self.method  = method
+        self.fitness = fitness
+        self.solver  = solver
+        self.nonneg  = nonneg
+
+        if nprocs is None:
+            nprocs = os.cpu_count()
+        self.nprocs = max(1, nprocs)
+
+        if self.p.ndim != 1 or self.C.ndim != 1:
+            raise InverterException("The p and C grids must be one-dimensional.")
+
+        self.fitnesses = None
+        self.alphas    = None
+        self.solutions = None
+
+
+    def run(self):
+        """
+        Runs the scan. Returns a tuple consisting of the fitness, the
+        regularization parameter alpha, and the solution in every point
+        of the grid. The arrays have shapes (len(p), len(C)),
+        (len(p), len(C)) and (len(p), len(C), N) respectively, where N is
+        the number of radial points.
+        """
+        tasks = self._getTasks()
+
+        if self.nprocs == 1:
+            results = [self._evaluate(ip, iC) for ip, iC in tasks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.nprocs, initializer=_initWorker, initargs=(self,)) as ex:
+                results = list(ex.map(_runTask, tasks))
+
+        nr = results[0][4].shape[1]
+        self.fitnesses = np.zeros((self.p.size, self.C.size))
+        self.alphas    = np.zeros((self.p.size, self.C.size))
+        self.solutions = np.zeros((self.p.size, self.C.size, nr))
+
+        for ip, iC, fitness, alpha, x in results:
+            self.fitnesses[ip,iC] = fitness
+            self.alphas[ip,iC]    = alpha
+            self.solutions[ip,iC] = x
+
+        return self.fitnesses, self.alphas, self.solutions
+
+
+    def getOptimum(self):
+        """
+        Returns the values of p* and C for which the fitness is
+        minimized, as well as the corresponding solution.
+        """
+        if self.fitnesses is None:
+            raise InverterException("The scan must be run before the optimum can be determined.")
+
+        ip, iC = np.unravel_index(np.argmin(self.fitnesses), self.fitnesses.shape)
+        return self.p[ip], self.C[iC], self.solutions[ip,iC]
+
+
+    def _getTasks(self):
+        """
+        Splits the scan into tasks. Each task consists of one value of p*
+        and a range of values of C (the Green's function slice for p* is
+        only loaded once per task). If there are fewer values of p* than
+        worker processes, the C grid is split so that all processes are
+        kept busy.
+        """
+        nchunks = min(self.C.size, max(1, -(-self.nprocs // self.p.size)))
+        chunks  = np.array_split(np.arange(self.C.size), nchunks)
+
+        return [(ip, iC) for ip in range(self.p.size) for iC in chunks]
+
+
+    def _evaluate(self, ip, iC):
+        """
+        Evaluates the model in the point p[ip] for all C[iC], and inverts
+        the data for each of the resulting Green's functions. The Green's
+        functions are evaluated one at a time, so that only one of them
+        is kept in memory.
+        """
+        fitness = np.zeros((iC.size,))
+        alpha   = np.zeros((iC.size,))
+        x       = None
+
+        for k, g in enumerate(self.model.evalIter(self.p[ip], self.C[iC])):
+            if not scipy.sparse.issparse(g):
+                g = g.reshape((g.shape[0], -1))
+
+            tk = Tikhonov([(self.data, g)], method=self.method, fitness=self.fitness, solver=self.solver, nonneg=self.nonneg)
+            xk, Ax = tk.invert()
+
+            if x is None:
+                x = np.zeros((iC.size, xk.size))
+
+            fitness[k] = tk.fitness(self.data, Ax)
+            alpha[k]   = tk.alpha
+            x[k]       = xk
+
+        return ip, iC, fitness, alpha, x
+
+
+# Scan object used by the worker processes
+_worker = None
+
+def _initWorker(scan):
+    global _worker
+    _worker = scan
+
+
+def _runTask(task):
+    return _worker._evaluate(*task)
+
+
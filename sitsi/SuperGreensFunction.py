@@ -4,23 +4,51 @@ files.
 """
 
 import h5py
+import json
 import numpy as np
+import os
 
+from . GreensFunctionCache import GreensFunctionCache
 from . InverterException import InverterException
 
 
 class SuperGreensFunction:
     
 
-    def __init__(self, files, splitdim=0):
+    # Default name of the index file
+    INDEXFILE = '.sitsi-index.json'
+
+
+    def __init__(self, files, splitdim=0, cachesize=0, maxfiles=16, mmap=False, dtype=None, index=False):
         """
         Constructor.
 
-        files:    List of files containing the Green's function. If the list
-                  contains multiple files, it is assumed that Green's function
-                  is split along one dimension into the separate files.
-        splitdim: Index of dimension which has been split. Alternatively, a
-                  string specifying the name of the dimension can given.
+        files:     List of files containing the Green's function. If the list
+                   contains multiple files, it is assumed that Green's function
+                   is split along one dimension into the separate files (which
+                   are ordered by their values of the split parameter).
+        splitdim:  Index of dimension which has been split. Alternatively, a
+                   string specifying the name of the dimension can given.
+        cachesize: Maximum number of bytes of recently used Green's function
+                   slices to keep in memory. Slices returned from the cache
+                   are read-only.
+        maxfiles:  Maximum number of Green's function files to keep open.
+        mmap:      If 'True', Green's functions which are stored contiguously
+                   and uncompressed are accessed through a read-only
+                   'numpy.memmap' of the file, so that no data is copied into
+                   memory until it is used (and so that several processes
+                   can share the same page-cached data). Other files are
+                   read using h5py.
+        dtype:     Type to convert the Green's function to when reading it
+                   (e.g. 'np.float32' to halve the memory used). By default,
+                   the type in which the function is stored is used.
+        index:     Index file in which the format and parameters of every
+                   Green's function file are stored, so that files which
+                   have not changed need not be opened when the Green's
+                   function is loaded again. If 'True', the index is kept
+                   in the file '.sitsi-index.json' in the directory of the
+                   first file. A file name may also be given. By default,
+                   no index file is used.
         """
         self.format = None
         self.paramlist = {}
@@ -40,6 +68,16 @@ class SuperGreensFunction:
         self.w  = None
         self.pixels = (0, 0)
 
+        self.cache = GreensFunctionCache(maxbytes=cachesize, maxfiles=maxfiles)
+
+        # Memory maps of the Green's function files (or 'None' for files
+        # which can not be memory mapped)
+        self.mmap = mmap
+        self.memmaps = {}
+
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.index = index
+
         self.processfile(files, splitdim=splitdim)
 
 
@@ -47,89 +85,217 @@ class SuperGreensFunction:
         """
         Process the list of input Green's function files in order to get
         a picture of what the full function actually consists of.
+
+        The parameters and format of every file are taken from the index
+        file (if enabled) for files which have not changed since they
+        were indexed, so that only new or modified files are opened.
         """
-        if files[0].endswith('.mat'):
-            tos = lambda v : "".join(map(chr, v[:,:][:,0].tolist()))
-        else:
-            tos = lambda v : v[:].tostring().decode('utf-8')
+        indexfile = self._indexPath(files)
+        index = self._loadIndex(indexfile)
+        changed = False
 
+        infos = []
         for f in files:
-            with h5py.File(f, 'r') as fh:
-                if self.format is None:
-                    self.format = tos(fh['type'])
-
-                    if type(splitdim) == int:
-                        self.splitdim = splitdim
-                    else:
-                        self.splitdim = self.format.find(splitdim)
-                        if self.splitdim < 0:
-                            raise InverterException("Invalid split dimension specified.")
-
-                    self.param1name = tos(fh['param1name'])
-                    self.param2name = tos(fh['param2name'])
-
-                    # We assume that the super Green's function is split based
-                    # on the first dimension (which may not be a pixel).
-                    #if (f0 != 'r') and (f0 != '1') and (f0 != '2') and (f0 != 'w'):
-                    #    raise InverterException("Invalid first dimension of Green's function.")
-                else:   # Verify that the format is the same as for all other files
-                    if self.format != tos(fh['type']):
-                        raise InverterException("The specified Green's functions have different formats.")
-
-                    if (self.param1name != tos(fh['param1name'])) or (self.param2name != tos(fh['param2name'])):
-                        raise InverterException("The specified Green's functions have different momentum parameters.")
-
-                r  = fh['r'][:]
-                p1 = fh['param1'][:]
-                p2 = fh['param2'][:]
-                w  = fh['wavelengths'][:]
-
-                if 'rowpixels' in fh:
-                    self.pixels = (int(fh['rowpixels'][:][0]), int(fh['colpixels'][:][0]))
-
-                self._setParameters(r, p1, p2, w, filename=f)
-
-
-        # Convert the constructed parameter list to a list of indices
-        fileparamlist = []
-        indices = []
-        localindices = []
+            key = self._indexKey(f, indexfile)
+            st  = os.stat(f)
+
+            info = index.get(key)
+            if info is None or info['size'] != st.st_size or info['mtime'] != st.st_mtime_ns:
+                info = self._readFileInfo(f)
+                info['size']  = st.st_size
+                info['mtime'] = st.st_mtime_ns
+
+                index[key] = info
+                changed = True
+
+            infos.append(info)
+
+        for f, info in self._sortFiles(files, infos, splitdim):
+            if self.format is None:
+                self.format = info['format']
+
+                if type(splitdim) == int:
+                    self.splitdim = splitdim
+                else:
+                    self.splitdim = self.format.find(splitdim)
+                    if self.splitdim < 0:
+                        raise InverterException("Invalid split dimension specified.")
+
+                self.param1name = info['param1name']
+                self.param2name = info['param2name']
+
+                # We assume that the super Green's function is split based
+                # on the first dimension (which may not be a pixel).
+                #if (f0 != 'r') and (f0 != '1') and (f0 != '2') and (f0 != 'w'):
+                #    raise InverterException("Invalid first dimension of Green's function.")
+            else:   # Verify that the format is the same as for all other files
+                if self.format != info['format']:
+                    raise InverterException("The specified Green's functions have different formats.")
+
+                if (self.param1name != info['param1name']) or (self.param2name != info['param2name']):
+                    raise InverterException("The specified Green's functions have different momentum parameters.")
+
+            if info['pixels'] is not None:
+                self.pixels = tuple(info['pixels'])
+
+            r  = self._fromIndex(info['r'])
+            p1 = self._fromIndex(info['param1'])
+            p2 = self._fromIndex(info['param2'])
+            w  = self._fromIndex(info['wavelengths'])
+
+            self._setParameters(r, p1, p2, w, filename=f)
+
+        if changed and indexfile is not None:
+            self._saveIndex(indexfile, index)
+
+        # Map every parameter index of the super Green's function to the
+        # file containing it, and to the index in that file. The
+        # parameters of the files are concatenated in the (sorted) order
+        # of the files, so the files' parameter lists follow one another.
+        self.fileparamlist = []
+        self.localindices  = []
         for key, val in self.paramlist.items():
-            l = list()
-            i = 0
-            for v in val:
-                indices.append(self.getParameterIndex(v))
-                fileparamlist.append(key)
-                localindices.append(i)
+            self.fileparamlist += [key] * len(val)
+            self.localindices  += list(range(len(val)))
+
+
+    def _sortFiles(self, files, infos, splitdim):
+        """
+        Returns the list of tuples (file, info) ordered by the smallest
+        value of the split parameter in each file, so that the parameters
+        of the super Green's function are in the same order regardless
+        of the order in which the files are given.
+        """
+        if len(files) < 2:
+            return list(zip(files, infos))
+
+        fmt = infos[0]['format']
+        if type(splitdim) != int:
+            splitdim = fmt.find(splitdim)
+            if splitdim < 0:
+                raise InverterException("Invalid split dimension specified.")
+
+        names = {'r': 'r', '1': 'param1', '2': 'param2', 'w': 'wavelengths'}
+        if fmt[splitdim] not in names:
+            raise InverterException("Invalid split dimension specified.")
+
+        name  = names[fmt[splitdim]]
+        first = [np.amin(self._fromIndex(info[name])) for info in infos]
+        order = sorted(range(len(files)), key=lambda k : first[k])
+
+        return [(files[k], infos[k]) for k in order]
+
+
+    def _readFileInfo(self, filename):
+        """
+        Reads the format, parameter names and parameter values of the
+        Green's function in the named file. Returns a dict which can be
+        stored in the index file.
+        """
+        if filename.endswith('.mat'):
+            tos = lambda v : "".join(map(chr, v[:,:][:,0].tolist()))
+        else:
+            tos = lambda v : v[:].tobytes().decode('utf-8')
+
+        with h5py.File(filename, 'r') as fh:
+            info = {
+                'format': tos(fh['type']),
+                'param1name': tos(fh['param1name']),
+                'param2name': tos(fh['param2name']),
+                'r': self._toIndex(fh['r'][:]),
+                'param1': self._toIndex(fh['param1'][:]),
+                'param2': self._toIndex(fh['param2'][:]),
+                'wavelengths': self._toIndex(fh['wavelengths'][:]),
+                'pixels': None
+            }
+
+            if 'rowpixels' in fh:
+                info['pixels'] = [int(fh['rowpixels'][:][0]), int(fh['colpixels'][:][0])]
+
+        return info
+
+
+    def _indexPath(self, files):
+        """
+        Returns the name of the index file to use for the given list of
+        Green's function files (or 'None' if no index file is used).
+        """
+        if self.index is True:
+            return os.path.join(os.path.dirname(os.path.abspath(files[0])), self.INDEXFILE)
+        elif self.index:
+            return self.index
+        else:
+            return None
+
+
+    def _indexKey(self, filename, indexfile):
+        """
+        Returns the name under which the named file is stored in the
+        index (relative to the directory of the index file, so that the
+        index remains valid if the directory is moved).
+        """
+        if indexfile is None:
+            return filename
+
+        return os.path.relpath(os.path.abspath(filename), os.path.dirname(os.path.abspath(indexfile)))
+
+
+    def _loadIndex(self, indexfile):
+        if indexfile is None or not os.path.isfile(indexfile):
+            return dict()
+
+        try:
+            with open(indexfile, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+
+    def _saveIndex(self, indexfile, index):
+        """
+        Writes the index file. The index is only an optimization, and so
+        failure to write it (e.g. in a read-only directory) is ignored.
+        """
+        tmp = '{0}.{1}.tmp'.format(indexfile, os.getpid())
+
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+
+            os.replace(tmp, indexfile)
+        except OSError:
+            pass
 
-                i += 1
 
-        self.fileparamlist = [f for _, f in sorted(zip(indices, fileparamlist))]
-        self.localindices  = localindices
+    def _toIndex(self, arr):
+        return {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'data': arr.ravel().tolist()}
+
+
+    def _fromIndex(self, d):
+        return np.array(d['data'], dtype=np.dtype(d['dtype'])).reshape(d['shape'])
 
 
     def __getitem__(self, index):
         """
-        Retrieve the Green's function value by index. The first index is
-        the varied parameter. If it is a float, the data for the function
-        with a parameter value closest to the one specified is returned.
+        Retrieve the Green's function value by index. The index along the
+        split dimension is the varied parameter. If it is a float, the data
+        for the function with a parameter value closest to the one specified
+        is returned.
         """
+        if type(index) != tuple:
+            index = (index,)
+
+        index = self._normalizeIndex(index)
         p = index[self.splitdim]
-        f = None
-
-        if type(p) == int or type(p) == tuple:
-            f = self._getFunction(p)
-        elif type(p) == slice:
-            f = self._getFunction(index)
-        elif type(p) == float:
-            f = self._getFunction(self.getParameterIndex(p))
-        else:
+
+        if type(p) == float:
+            index = list(index)
+            index[self.splitdim] = self.getParameterIndex(p)
+            index = tuple(index)
+        elif not (isinstance(p, (int, np.integer, slice, list, np.ndarray))):
             raise InverterException("Invalid type '{}' of first index.".format(type(p)))
 
-        if len(index) > 1:
-            return f[index[1:]]
-        else:
-            return f
+        return self._getFunction(index)
 
 
     def get(self, r=None, p1=None, p2=None, w=None, i=None, j=None):
@@ -144,41 +310,204 @@ class SuperGreensFunction:
 
     def _getFunction(self, idx):
         """
-        Returns the Green's function with the specified index.
+        Returns the part of the Green's function selected by the given index.
+        Only the requested hyperslab is read from disk. Selections along the
+        split dimension which span several files are read file by file and
+        assembled into a single output array.
         """
-        filename = None
+        if type(idx) != tuple:
+            idx = (idx,)
+
+        idx = self._normalizeIndex(idx)
+
+        key = self._cacheKey(idx)
+        func = self.cache.getSlice(key)
+
+        if func is None:
+            func = self._assemble(idx)
+
+            # Memory mapped data is already shared via the page cache
+            if not isinstance(func, np.memmap):
+                self.cache.putSlice(key, func)
 
-        if type(idx) == tuple:
-            filename = self.fileparamlist[idx[self.splitdim]]
-            lst = []
+        return func
 
-            # Get the selection as a list of indices (or range)
-            if type(idx[self.splitdim]) == slice:
-                ix = idx[self.splitdim]
-                ifnone = lambda a, b: b if a is None else a
-                lst = range(ifnone(ix.start, 0), ifnone(ix.stop, len(self.fileparamlist)), ifnone(ix.step, 1))
-                filename = filename[0]
+
+    def _assemble(self, idx):
+        """
+        Reads the part of the Green's function selected by the given
+        (normalized) index from disk.
+        """
+        sel = idx[self.splitdim]
+
+        if np.ndim(sel) == 0 and not isinstance(sel, slice):
+            return self._readFile(self.fileparamlist[sel], self._localIndex(idx, self.localindices[sel]))
+        elif isinstance(sel, slice):
+            gidx = list(range(*sel.indices(len(self.fileparamlist))))
+        else:
+            gidx = list(sel)
+
+        if len(gidx) == 0:
+            return self._readFile(self.fileparamlist[0], self._localIndex(idx, slice(0, 0)))
+
+        # Group the requested parameter indices into runs which are
+        # located in the same file
+        blocks = []
+        for k in range(len(gidx)):
+            fname = self.fileparamlist[gidx[k]]
+            if len(blocks) > 0 and blocks[-1][0] == fname:
+                blocks[-1][1].append(self.localindices[gidx[k]])
             else:
-                lst = [idx[self.splitdim]]
+                blocks.append((fname, [self.localindices[gidx[k]]], k))
+
+        # Position of the split dimension in the output array
+        # (integer indices in front of it remove dimensions)
+        axis = self.splitdim - sum(1 for i in idx[:self.splitdim] if np.ndim(i) == 0 and not isinstance(i, slice))
+
+        out = None
+        for fname, local, k in blocks:
+            d = self._readBlock(fname, idx, local, axis)
+
+            if len(blocks) == 1:
+                return d
+
+            if out is None:
+                shape = list(d.shape)
+                shape[axis] = len(gidx)
+                out = np.empty(shape, dtype=d.dtype)
+
+            s = [slice(None),] * out.ndim
+            s[axis] = slice(k, k+len(local))
+            out[tuple(s)] = d
+
+        return out
+
+
+    def _readBlock(self, filename, idx, local, axis):
+        """
+        Reads the Green's function elements with the given local indices
+        (along the split dimension) from the named file.
+        """
+        # h5py only accepts increasing indices, so we represent the list
+        # of indices as a slice whenever possible and re-order the data
+        # in memory otherwise
+        steps = np.diff(local)
+        if len(local) == 1:
+            return self._readFile(filename, self._localIndex(idx, slice(local[0], local[0]+1)))
+        elif np.all(steps == steps[0]) and steps[0] > 0:
+            return self._readFile(filename, self._localIndex(idx, slice(local[0], local[-1]+1, int(steps[0]))))
+        else:
+            u, inv = np.unique(local, return_inverse=True)
+            d = self._readFile(filename, self._localIndex(idx, u.tolist()))
+            return np.take(d, inv, axis=axis)
 
-            # Check that all elements of split dimension are in
-            # the same physical file
-            for i in lst:
-                if filename != self.fileparamlist[i]:
-                    raise InverterException("Trying to load multiple Green's functions simultaneously.")
-        elif type(idx) == int:
-            filename = self.fileparamlist[idx]
 
-        func = None
-        with h5py.File(filename, 'r') as f:
-            func = f['func'][:]
+    def _readFile(self, filename, idx):
+        """
+        Reads the given hyperslab of the Green's function stored in the
+        named file.
+        """
+        if self.mmap:
+            mm = self._getMemmap(filename)
+            if mm is not None:
+                if self.dtype is None or self.dtype == mm.dtype:
+                    return mm[idx]
+                else:
+                    return mm[idx].astype(self.dtype)
+
+        func = self.cache.getFile(filename)['func']
+
+        # Let h5py convert the data while reading it
+        if self.dtype is not None and self.dtype != func.dtype:
+            func = func.astype(self.dtype)
 
         if func.ndim == len(self.format):
-            ix = list(idx)
-            ix[self.splitdim] = self.localindices[idx[self.splitdim]]
-            return func[tuple(ix)]
+            return func[idx]
         else:
-            return func
+            return func[:]
+
+
+    def _getMemmap(self, filename):
+        """
+        Returns a read-only memory map of the Green's function stored in
+        the named file, or 'None' if the dataset is chunked, compressed or
+        otherwise not stored as one contiguous block of raw data.
+        """
+        if filename in self.memmaps:
+            return self.memmaps[filename]
+
+        mm = None
+        func = self.cache.getFile(filename)['func']
+        offset = func.id.get_offset()
+
+        if func.chunks is None and func.compression is None and offset is not None \
+           and func.ndim == len(self.format) and func.dtype.kind in 'biufc':
+            mm = np.memmap(filename, dtype=func.dtype, mode='r', offset=offset, shape=func.shape, order='C')
+
+        self.memmaps[filename] = mm
+        return mm
+
+
+    def __getstate__(self):
+        """
+        Memory maps are re-created (rather than copied) when the Green's
+        function is pickled.
+        """
+        state = self.__dict__.copy()
+        state['memmaps'] = {}
+
+        return state
+
+
+    def _cacheKey(self, idx):
+        """
+        Converts the given index into a hashable key for the cache.
+        """
+        key = []
+        for i in idx:
+            if isinstance(i, slice):
+                key.append(('slice', i.start, i.stop, i.step))
+            elif np.ndim(i) == 0:
+                key.append(int(i))
+            else:
+                key.append(tuple(np.asarray(i).tolist()))
+
+        return tuple(key)
+
+
+    def cacheInfo(self):
+        """
+        Returns a dict with the number of cache hits and misses, as well
+        as the current size of the Green's function cache.
+        """
+        return self.cache.info()
+
+
+    def close(self):
+        """
+        Closes all open Green's function files (and memory maps) and
+        empties the cache.
+        """
+        self.cache.clear()
+        self.memmaps = {}
+
+
+    def _localIndex(self, idx, local):
+        """
+        Replaces the index along the split dimension in 'idx' with the
+        given file-local index.
+        """
+        ix = list(idx)
+        ix[self.splitdim] = local
+        return tuple(ix)
+
+
+    def _normalizeIndex(self, idx):
+        """
+        Pads the given index tuple with ':' so that it has one element
+        per dimension of the Green's function.
+        """
+        return tuple(idx) + (slice(None),) * (len(self.format) - len(idx))
 
 
     def getParameterIndex(self, v, name=None):
@@ -209,7 +538,7 @@ class SuperGreensFunction:
 
         if r  is None: r  = slice(None)
         if p1 is None: p1 = slice(None)
-        if p1 is None: p1 = slice(None)
+        if p2 is None: p2 = slice(None)
         if w  is None: w  = slice(None)
         if i  is None: i  = slice(None)
         if j  is None: j  = slice(None)
@@ -240,13 +569,13 @@ class SuperGreensFunction:
             self.w  = w
         else:
             # Else, append the parameter
-            if np.any(self.r != r):
+            if not np.array_equal(self.r, r):
                 self.r = np.concatenate((self.r, r))
-            elif np.any(self.p1 != p1):
+            elif not np.array_equal(self.p1, p1):
                 self.p1 = np.concatenate((self.p1, p1))
-            elif np.any(self.p2 != p2):
+            elif not np.array_equal(self.p2, p2):
                 self.p2 = np.concatenate((self.p2, p2))
-            elif np.any(self.w != w):
+            elif not np.array_equal(self.w, w):
                 self.w = np.concatenate((self.w, w))
             else:
                 raise InverterException("All parameters are the same in '{}' as in the first Green's function.".format(filename))
@@ -2,18 +2,35 @@
 import h5py
 import numpy as np
 
+from .FilterCache import FilterCache
+from .Filters.Filter import Filter
 from .Image import Image
 from .InverterException import InverterException
+from .LazyFrames import LazyFrames
+from .VideoStream import VideoStream
 
 
 class Video:
     
-    def __init__(self, data=None, filters=list()):
+    def __init__(self, data=None, filters=list(), lazy=False, blocksize=64, dtype=np.double, nworkers=1, cachedir=None):
         """
         Constructor.
 
-        data: May be either a filename (in which case the data is loaded
-              from the named file) or a Video object which should be copied.
+        data:      May be either a filename (in which case the data is loaded
+                   from the named file) or a Video object which should be copied.
+        lazy:      If 'True', frames are only read from the file (and
+                   filtered) when they are accessed. The file is kept open
+                   until 'close()' is called.
+        blocksize: Number of frames to read at a time in lazy mode.
+        dtype:     Floating-point type to store frames in (e.g. 'np.float32'
+                   to halve the memory used).
+        nworkers:  Number of threads to divide the work of the filters
+                   between (see 'applyFilters()').
+        cachedir:  Directory in which to cache filtered videos (see
+                   'FilterCache'). If given, the filters are only applied
+                   if the same video has not been filtered with the same
+                   filters before (not used in lazy mode, or once the
+                   frames have been changed, e.g. by 'interpolate()').
         """
         self.frames    = list()
         self.rawframes = list()
@@ -24,11 +41,21 @@ class Video:
         self.Y         = list()
 
         self.filters  = filters
+        self.lazy     = lazy
+        self.blocksize = blocksize
+        self.dtype    = dtype
+        self.nworkers = nworkers
+        self.cachedir = cachedir
+        self.filename = None
+
+        # Frames as loaded from 'self.filename' (the filter cache is only
+        # used when filtering these)
+        self.fileframes = None
 
         self.true_framemaxs = [None]*len(self.frames)
 
         if type(data) == str:
-            self.loadVideoHDF5(data)
+            self.loadVideoHDF5(data, lazy=lazy)
         elif type(data) == Video:
             self.frames    = np.copy(data.frames)
             self.rawframes = np.copy(data.rawframes)
@@ -44,36 +71,121 @@ class Video:
 
         self.applyFilters()
 
+
+    @property
+    def framemax(self):
+        """
+        Maximum value of all frames. In lazy mode, the maximum is taken
+        from the file if stored there, and is otherwise computed (block
+        by block) when first requested.
+        """
+        if self._framemax is None:
+            self._framemax = self._framemaxframes.max()
+
+        return self._framemax
+
+
+    @framemax.setter
+    def framemax(self, value):
+        self._framemax = value
+
     
-    def applyFilters(self):
+    def applyFilters(self, nworkers=None):
         """
         Apply all the filters assigned to this video.
+
+        nworkers: Number of threads to divide the work of the filters
+                  between. Filters are split by blocks of frames or by
+                  rows of pixels (depending on the filter), and give the
+                  same result as when run serially. By default, the
+                  value given to the constructor is used. (In lazy mode,
+                  frames are always filtered serially as they are read.)
         """
+        if nworkers is None:
+            nworkers = self.nworkers
+
+        if isinstance(self.frames, LazyFrames):
+            # Filters are applied as frames are read
+            self.rawframes = self.frames
+            self.frames    = LazyFrames(VideoStream(self.frames.stream.filename, self.filters, self.blocksize, dtype=self.dtype))
+            return
+
         self.rawframes = self.frames
-        d = np.copy(self.frames)
 
-        for f in self.filters:
-            d = f.apply(self.times, d)
+        cache = None
+        if self.cachedir is not None and self.frames is self.fileframes and len(self.filters) > 0:
+            cache  = FilterCache(self.cachedir)
+            frames = cache.load(self.filename, self.filters, self.dtype)
+
+            if frames is not None:
+                self.frames = frames
+                return
 
-        self.frames = d
+        # The raw frames are kept, and the filters write their output
+        # to a single new array (wherever possible)
+        self.frames = Filter.applyChain(self.filters, self.times, self.rawframes, nworkers=nworkers)
 
+        if cache is not None:
+            cache.store(self.filename, self.filters, self.dtype, self.frames)
 
-    def computeTrueMaxima(self):
-        for i in range(0, len(self.frames)):
-            self.getTrueMaximum(i)
+
+    def computeTrueMaxima(self, threshold=1e-3, order=5, blocksize=256):
+        """
+        Computes the 'true' maximum (see 'getTrueMaximum()') of all frames
+        of the video, processing 'blocksize' frames at a time.
+        """
+        nframes = len(self.frames)
+        for i in range(0, nframes, blocksize):
+            idx = [j for j in range(i, min(i+blocksize, nframes)) if self.true_framemaxs[j] is None]
+            if len(idx) == 0:
+                continue
+
+            m = self._trueMaxima(self.frames[idx], threshold, order)
+            for j in range(len(idx)):
+                self.true_framemaxs[idx[j]] = m[j]
 
         return self.true_framemaxs
 
 
-    def loadVideoHDF5(self, filename):
+    def close(self):
+        """
+        Close the video file (in lazy mode).
+        """
+        for frm in [self.frames, self.rawframes]:
+            if isinstance(frm, LazyFrames):
+                frm.close()
+
+
+    def loadVideoHDF5(self, filename, lazy=False):
         """
         Loads the video from the file with the given name.
 
         filename: Name of file to load.
+        lazy:     If 'True', only the times and metadata are loaded, and
+                  frames are read when they are accessed.
         """
+        self.filename = filename
+
+        if lazy:
+            stream = VideoStream(filename, blocksize=self.blocksize, dtype=self.dtype)
+            self.frames    = LazyFrames(stream)
+            self.rawframes = self.frames
+            self.times     = stream.times
+            self.info      = stream.info
+
+            self.framemax  = stream._file()['frames'].attrs.get('framemax', None)
+            self._framemaxframes = self.rawframes
+
+            self.X = list(range(stream.frameshape[0]-1, -1, -1))
+            self.Y = list(range(0, stream.frameshape[1]))
+
+            self.true_framemaxs = [None]*len(self.frames)
+            return
+
         with h5py.File(filename, 'r') as f:
-            self.frames    = f['frames'][:].transpose((0,2,1)).astype(np.double)
-            self.rawframes = np.copy(self.frames)
+            self.frames    = f['frames'][:].transpose((0,2,1)).astype(self.dtype)
+            self.rawframes = self.frames
+            self.fileframes = self.frames
             self.times     = f['times'][:]
             self.framemax  = np.amax(self.frames)
 
@@ -121,8 +233,70 @@ class Video:
         if self.true_framemaxs[frameindex] is not None:
             return self.true_framemaxs[frameindex]
 
-        f = np.sort(self.frames[frameindex], axis=None)
+        m = self._trueMaxima(self.frames[frameindex][np.newaxis], threshold, order)[0]
+        self.true_framemaxs[frameindex] = m
+
+        return m
 
+
+    def _trueMaxima(self, frames, threshold, order):
+        """
+        Computes the 'true' maximum of each of the given frames. Walking
+        down from the largest pixel value, the true maximum is the first
+        value f[i] for which none of the 'order' relative differences
+
+          |f[k] - f[k-1]| / f[k],    k = i, i-1, ..., i-order+1
+
+        exceed 'threshold'. Only the largest values of each frame are
+        sorted (more are included if the true maximum is not among them).
+        """
+        data = frames.reshape((frames.shape[0], -1))
+        n = data.shape[1]
+        result = np.zeros((data.shape[0],), dtype=data.dtype)
+        todo = np.arange(data.shape[0])
+
+        K = min(n, max(256, 2*order))
+        while todo.size > 0:
+            if K < n:
+                f = np.partition(data[todo], n-K, axis=1)[:,n-K:]
+                f.sort(axis=1)
+            else:
+                f = np.sort(data[todo], axis=1)
+
+            # Relative differences (the first is unknown)
+            errs = np.geterr()
+            np.seterr(divide='ignore', invalid='ignore')
+            bad = np.ones(f.shape, dtype=bool)
+            bad[:,1:] = (np.abs(f[:,1:] - f[:,:-1]) / f[:,1:]) > threshold
+            np.seterr(**errs)
+
+            # Find the largest index for which 'order' consecutive relative
+            # differences are all below the threshold
+            c = np.cumsum(bad, axis=1)
+            good = np.zeros(f.shape, dtype=bool)
+            good[:,order:] = (c[:,order:] - c[:,:-order]) == 0
+
+            found = np.any(good, axis=1)
+            last  = K-1 - np.argmax(good[:,::-1], axis=1)
+            result[todo[found]] = f[found, last[found]]
+
+            if K == n:
+                # Handle the remaining frames by walking through all values
+                for i in todo[~found]:
+                    result[i] = self._trueMaximumFull(f[np.nonzero(todo == i)[0][0]], threshold, order)
+                break
+
+            todo = todo[~found]
+            K = min(n, 4*K)
+
+        return result
+
+
+    def _trueMaximumFull(self, f, threshold, order):
+        """
+        Computes the 'true' maximum of a frame, given all its
+        values in sorted order.
+        """
         i = f.size-1
         r = lambda index : np.abs(f[index] - f[index-1]) / f[index]
 
@@ -133,29 +307,64 @@ class Video:
             i -= 1
             for j in range(0, order): rv[j] = r(i-j)
 
-        self.true_framemaxs[frameindex] = f[i]
-
         return f[i]
     
 
-    def interpolate(self, times):
+    def interpolate(self, times, method='nearest'):
         """
         Interpolate the frames of this video to
-        the times in the given list. A 'closest'
-        interpolation is done, meaning that the
-        frame corresponding to the closest time of
-        each element in 'times' is selected.
+        the times in the given list. By default, a
+        'closest' interpolation is done, meaning that
+        the frame corresponding to the closest time of
+        each element in 'times' is selected. The times
+        of the video must be sorted.
         
-        times: List of times to interpolate this video to.
+        times:  List of times to interpolate this video to.
+        method: Either 'nearest' (select closest frame) or 'linear'
+                (interpolate linearly between the two closest frames).
         """
-        nframes = list()
-        for i in range(0, len(times)):
-            j = np.argmin(np.abs(self.times - times[i]))
-            nframes.append(self.frames[j])
+        times = np.asarray(times)
+        n = len(self.times)
+
+        # Indices of the frames immediately before and after each time
+        j1 = np.clip(np.searchsorted(self.times, times), min(1, n-1), n-1)
+        j0 = np.maximum(j1-1, 0)
+
+        if method == 'nearest':
+            # Select the closest frame (the first one in case of ties)
+            j = np.where(np.abs(self.times[j0] - times) <= np.abs(self.times[j1] - times), j0, j1)
+            j = np.searchsorted(self.times, self.times[j])
+
+            if isinstance(self.frames, LazyFrames):
+                self.frames = self.frames.take(j)
+                self.framemax = None
+                self._framemaxframes = self.frames
+            else:
+                nframes = np.empty((j.size,) + self.frames.shape[1:], dtype=self.frames.dtype)
+                np.take(self.frames, j, axis=0, out=nframes)
+
+                self.frames = nframes
+                self.framemax = np.amax(self.frames)
+        elif method == 'linear':
+            dt = self.times[j1] - self.times[j0]
+            w = np.divide(times - self.times[j0], dt, out=np.zeros(times.shape), where=(dt != 0))
+            w = np.clip(w, 0, 1)
+
+            nframes = np.empty((times.size,) + self.frames.shape[1:], dtype=self.dtype)
+            for i in range(0, times.size, self.blocksize):
+                s = slice(i, i+self.blocksize)
+                wi = w[s].reshape((-1,) + (1,)*(nframes.ndim-1))
+
+                np.multiply(self.frames[j0[s]], 1-wi, out=nframes[s], casting='unsafe')
+                nframes[s] += self.frames[j1[s]] * wi
+
+            self.frames = nframes
+            self.framemax = np.amax(self.frames)
+        else:
+            raise InverterException("Unrecognized interpolation method: '{}'.".format(method))
 
-        self.frames = np.array(nframes)
         self.times  = np.array(times)
-        self.framemax = np.amax(self.frames)
+        self.true_framemaxs = [None]*len(self.times)
 
 
     def setSubset(self, x, y=None, w=None, h=None):
@@ -0,0 +1,191 @@
+"""
+Streams the frames of a video stored in an HDF5 file block by block,
+applying a chain of filters to each block. Temporal filters are given
+the neighbouring frames they need (their 'halo') on either side of each
+block, so that the result is the same as when filtering the full video,
+while the memory used depends only on the block size.
+"""
+
+import copy
+import h5py
+import numpy as np
+
+from .Filters.Filter import Filter
+from .InverterException import InverterException
+
+
+class VideoStream:
+
+
+    def __init__(self, filename, filters=list(), blocksize=256, dtype=np.double):
+        """
+        Constructor.
+
+        filename:  Name of HDF5 file containing the video.
+        filters:   List of filters to apply to the video.
+        blocksize: Number of frames to return in each block.
+        dtype:     Floating-point type to convert frames to.
+        """
+        self.filename  = filename
+        # The properties computed by filters in 'prepare()' belong to this
+        # stream, so the stream works on copies of the given filters
+        # (which may also be used to filter other videos)
+        self.filters   = [copy.copy(f) for f in self._flatten(filters)]
+        self.blocksize = blocksize
+        self.dtype     = np.dtype(dtype)
+
+        if self.blocksize < 1:
+            raise InverterException("The block size must be positive.")
+
+        # File handle (opened on first use)
+        self.fh = None
+        self.prepared = False
+
+        f = self._file()
+        self.nframes = f['frames'].shape[0]
+
+        # Shape of a frame (after transposing)
+        self.frameshape = (f['frames'].shape[2], f['frames'].shape[1])
+        self.times   = f['times'][:]
+
+        self.info = dict()
+        for key in f['info'].keys():
+            self.info[key] = f['info'][key][:]
+
+
+    def __iter__(self):
+        """
+        Iterate over tuples (times, frames) of consecutive blocks of
+        filtered frames.
+        """
+        try:
+            self.prepare()
+            yield from self._blocks(self.filters)
+        finally:
+            self.release()
+
+
+    def close(self):
+        """
+        Close the video file.
+        """
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+
+    def prepare(self):
+        """
+        Give filters which depend on the full video a pass over their
+        (filtered) input (unless this has already been done).
+        """
+        if self.prepared:
+            return
+
+        for i in range(len(self.filters)):
+            if self.filters[i].prepass:
+                self.filters[i].prepare(self._blocks(self.filters[:i]))
+
+        self.prepared = True
+
+
+    def release(self):
+        """
+        Make the filters forget the properties computed in 'prepare()'.
+        """
+        for f in self.filters:
+            f.release()
+
+        self.prepared = False
+
+
+    def read(self, start, end, filters=None):
+        """
+        Read the frames with indices start, ..., end-1 from the file,
+        filtered with the given list of filters (by default the filters
+        of this stream). 'prepare()' must have been called first if any
+        of the filters need a pre-pass.
+        """
+        if filters is None:
+            filters = self.filters
+
+        halo = sum([f.halo for f in filters])
+
+        # Include neighbouring frames needed by the filters
+        hstart = max(0, start-halo)
+        hend   = min(self.nframes, end+halo)
+
+        times = self.times[hstart:hend]
+        data  = self._file()['frames'][hstart:hend].transpose((0,2,1)).astype(self.dtype)
+
+        # The frames read are not used elsewhere, and so can be filtered
+        # in place
+        data = Filter.applyChain(filters, times, data, out=data)
+
+        return data[(start-hstart):(end-hstart)]
+
+
+    def write(self, filename):
+        """
+        Filter the video and write the result to the named HDF5 file, using
+        the same layout as the input file (so that it can be loaded with
+        'Video').
+        """
+        with h5py.File(filename, 'w') as f:
+            shape = (self.nframes, self.frameshape[1], self.frameshape[0])
+            frames = f.create_dataset('frames', shape, dtype=self.dtype)
+
+            framemax = None
+            i = 0
+            for _, data in self:
+                frames[i:i+data.shape[0]] = data.transpose((0,2,1))
+                framemax = np.amax(data) if framemax is None else max(framemax, np.amax(data))
+                i += data.shape[0]
+
+            # Store the maximum so that it need not be recomputed
+            # when the video is loaded lazily
+            if framemax is not None:
+                frames.attrs['framemax'] = framemax
+
+            f['times'] = self.times
+
+            info = f.create_group('info')
+            for key, val in self.info.items():
+                info[key] = val
+
+
+    def _blocks(self, filters):
+        """
+        Iterate over consecutive blocks of frames, filtered with the
+        given list of filters.
+        """
+        for start in range(0, self.nframes, self.blocksize):
+            end = min(start+self.blocksize, self.nframes)
+            yield self.times[start:end], self.read(start, end, filters)
+
+
+    def _file(self):
+        """
+        Returns a handle to the (open) video file.
+        """
+        if self.fh is None:
+            self.fh = h5py.File(self.filename, 'r')
+
+        return self.fh
+
+
+    def _flatten(self, filters):
+        """
+        Expand composite filters (such as 'AUGPhantomV711') into the list
+        of filters they consist of.
+        """
+        lst = []
+        for f in filters:
+            if hasattr(f, 'filters'):
+                lst += self._flatten(f.filters)
+            else:
+                lst.append(f)
+
+        return lst
+
+
@@ -1,4 +1,6 @@
 
+from .ParameterScan import ParameterScan
 from .SuperGreensFunction import SuperGreensFunction
 from .Video import Video
+from .VideoStream import VideoStream
 
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from sitsi.Filters import AUGPhantomV711, HXRFilter, RemoveArtifacts
+from sitsi.Filters.Filter import Filter
+
+
+def _video(seed=0, nframes=120, shape=(30, 24)):
+    rng = np.random.default_rng(seed)
+    data = 100 + rng.standard_normal((nframes,)+shape).cumsum(0)*0.5 + 20*rng.random((1,)+shape)
+    data[rng.random(data.shape) < 0.03] *= 3
+
+    return np.linspace(0, 0.1, nframes), data
+
+
+@pytest.mark.parametrize('nworkers', [2, 3, 8])
+@pytest.mark.parametrize('factory', [
+    lambda : [AUGPhantomV711()],
+    lambda : [RemoveArtifacts(), HXRFilter(tilesize=100)],
+    lambda : [HXRFilter(), RemoveArtifacts()]
+])
+def test_parallel_bit_identical(nworkers, factory):
+    times, data = _video()
+
+    serial   = Filter.applyChain(factory(), times, data)
+    parallel = Filter.applyChain(factory(), times, data, nworkers=nworkers)
+
+    assert np.array_equal(serial, parallel)
+
+
+def test_parallel_keeps_filter_state():
+    """
+    Filtering in parallel must not modify the (possibly shared) filters.
+    """
+    times, data = _video()
+    _, other    = _video(seed=1)
+
+    f = RemoveArtifacts()
+    f.prepare([(times, other)])
+    mean = f.mean.copy()
+
+    Filter.applyChain([f], times, data, nworkers=4)
+
+    assert np.array_equal(f.mean, mean)
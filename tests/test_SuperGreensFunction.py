@@ -0,0 +1,66 @@
+import h5py
+import numpy as np
+import pytest
+
+from sitsi.SuperGreensFunction import SuperGreensFunction
+
+
+def _tomat(s):
+    return np.array([[ord(c)] for c in s], dtype=np.uint16)
+
+
+def _writeGreensFunction(filename, r, p1, p2, func, fmt='r12ij'):
+    with h5py.File(filename, 'w') as f:
+        f['type'] = _tomat(fmt)
+        f['param1name'] = _tomat('p')
+        f['param2name'] = _tomat('thetap')
+        f['r'] = r
+        f['param1'] = p1
+        f['param2'] = p2
+        f['wavelengths'] = np.array([1.0])
+        f['func'] = func
+        f['rowpixels'] = np.array([func.shape[-2]])
+        f['colpixels'] = np.array([func.shape[-1]])
+
+
+@pytest.fixture
+def splitOnP1(tmp_path):
+    """
+    Green's function with format 'r12ij', split along p1 into three files.
+    """
+    rng = np.random.default_rng(0)
+    r  = np.linspace(0.1, 0.8, 2)
+    p1 = np.linspace(10, 50, 12)
+    p2 = np.linspace(0.05, 0.5, 5)
+    func = rng.random((2, 12, 5, 7, 8))
+
+    files = []
+    for k in range(3):
+        fname = str(tmp_path / 'green{}.mat'.format(k))
+        _writeGreensFunction(fname, r, p1[4*k:4*k+4], p2, func[:,4*k:4*k+4])
+        files.append(fname)
+
+    return SuperGreensFunction(files, splitdim='1'), func
+
+
+def test_slice_spanning_files(splitOnP1):
+    g, func = splitOnP1
+    assert np.array_equal(g.get(p1=slice(2, 10)), func[:,2:10])
+
+
+def test_list_spanning_files(splitOnP1):
+    g, func = splitOnP1
+    assert np.array_equal(g[1, [9, 1, 5, 2]], func[1, [9, 1, 5, 2]])
+    assert np.array_equal(g[:, [9, 1, 5, 2], 3], func[:, [9, 1, 5, 2], 3])
+
+
+def test_file_order(tmp_path, splitOnP1):
+    g, func = splitOnP1
+    files = [g.fileparamlist[0], g.fileparamlist[-1], g.fileparamlist[5]]
+
+    h = SuperGreensFunction(files[::-1], splitdim='1')
+    assert np.array_equal(h.p1, g.p1)
+    assert np.array_equal(h.get(p1=slice(1, 11)), func[:,1:11])
+
+    # No index file is written unless requested
+    assert not (tmp_path / SuperGreensFunction.INDEXFILE).exists()
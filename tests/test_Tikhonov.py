@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from sitsi.Algorithms.Tikhonov import Tikhonov
+
+
+@pytest.mark.parametrize('offset', [0.2, -0.5])
+def test_nonneg_curvature_diff(offset):
+    """
+    The seminorm of the non-negative 'diff' solutions reaches round-off
+    for large alpha, which must not be mistaken for the corner of the
+    L-curve (giving a flat profile).
+    """
+    rng = np.random.default_rng(0)
+    N, npix = 60, 1000
+
+    r  = np.linspace(0.01, 1, N)
+    G  = rng.random((N, npix))
+    xt = np.maximum(np.sin(6*r) + offset, 0)
+    b  = G.T.dot(xt)
+    b += 0.1*np.std(b)*rng.standard_normal(npix)
+
+    u = Tikhonov([(b, G)], method='diff', solver='normal')
+    u.invert(criterion='gcv')
+
+    t = Tikhonov([(b, G)], method='diff', solver='normal', nonneg=True)
+    x, _ = t.invert(criterion='curvature')
+
+    assert np.all(x >= 0)
+    assert t.alpha < 10*u.alpha
+    assert np.linalg.norm(x-xt) < 0.1*np.linalg.norm(xt)
+
+
+@pytest.mark.parametrize('method', ['diff', 'diff2'])
+@pytest.mark.parametrize('seed', range(4))
+def test_curvature_diff(method, seed):
+    """
+    Round-off in the null space of D must not give spurious corners of
+    the L-curve at large alpha.
+    """
+    rng = np.random.default_rng(seed)
+    N, npix = 50, 800
+
+    r  = np.linspace(0.01, 1, N)
+    G  = rng.random((N, npix))
+    xt = np.sin(3*r)**2 + 0.5
+    b  = G.T.dot(xt)
+    b += 0.02*np.std(b)*rng.standard_normal(npix)
+
+    t = Tikhonov([(b, G)], method=method, solver='normal')
+    x, _ = t.invert(criterion='curvature')
+
+    assert t.alpha < 1e3
+    assert np.linalg.norm(x-xt) < 0.02*np.linalg.norm(xt)
+
+    xs, alphas = t.invertFrames(b[np.newaxis,:], criterion='curvature')
+    assert np.allclose(alphas, t.alpha)
+
+
+@pytest.mark.parametrize('method,solver', [('diff', 'normal'), ('standard', 'lstsq'), ('svd', 'lstsq')])
+def test_series_warm_start(method, solver):
+    """
+    Consecutive similar frames should need only a few solves each, and
+    give the same alphas as inverting each frame from scratch (also
+    after an abrupt change, when the full range is searched again).
+    """
+    rng = np.random.default_rng(1)
+    N, npix, F = 30, 300, 20
+
+    r = np.linspace(0.01, 1, N)
+    G = rng.random((N, npix))
+    frames = np.array([G.T.dot(np.sin(3*r)**2 * (1+0.02*k)) + 1e-2*rng.standard_normal(npix) for k in range(F)])
+    frames[12] = G.T.dot(np.cos(9*r)**2) + 3*rng.standard_normal(npix)
+
+    t = Tikhonov([(frames[0], G)], method=method, solver=solver)
+    invfunc, resfunc = t._init()
+
+    nsolves = [0]
+    def count(func):
+        def wrapper(alpha):
+            nsolves[0] += 1
+            return func(alpha)
+        return wrapper
+
+    t.solvers = (count(invfunc), None if resfunc is None else count(resfunc))
+    _, alphas = t.invertSeries(frames)
+
+    cold = []
+    for f in frames:
+        c = Tikhonov([(f, G)], method=method, solver=solver)
+        c.invert()
+        cold.append(c.alpha)
+
+    assert np.array_equal(alphas, cold)
+    # One solve per frame is for the final solution, and the first and
+    # abrupt frames need a full search (evaluating the range of the
+    # fitness in every frame would alone cost 2*F solves)
+    assert nsolves[0] < 4.5*F
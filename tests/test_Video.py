@@ -0,0 +1,43 @@
+import h5py
+import numpy as np
+
+from sitsi.Filters import AUGPhantomV711
+from sitsi.Video import Video
+
+
+def _writeVideo(filename, seed, nframes=200, shape=(30, 24)):
+    rng = np.random.default_rng(seed)
+    data = 100 + rng.standard_normal((nframes,)+shape).cumsum(0)*0.5 + 20*rng.random((1,)+shape)
+    data[rng.random(data.shape) < 0.03] *= 3
+
+    with h5py.File(filename, 'w') as f:
+        f['frames'] = data.astype(np.uint16)
+        f['times'] = np.linspace(0, 0.1, nframes)
+        f.create_group('info')['fps'] = np.array([7000.])
+
+
+def test_shared_filters(tmp_path):
+    """
+    Filtering several videos with the same filter objects must give the
+    same result as filtering each of them with its own filters.
+    """
+    A, B, C = [str(tmp_path / '{}.h5'.format(n)) for n in 'ABC']
+    for seed, fname in enumerate([A, B, C]):
+        _writeVideo(fname, seed)
+
+    filters = [AUGPhantomV711()]
+
+    a = Video(A, filters=filters, lazy=True, blocksize=64)
+    first = a.frames[10].copy()
+
+    b = Video(B, filters=filters)
+    assert np.array_equal(b.frames, Video(B, filters=[AUGPhantomV711()]).frames)
+
+    c = Video(C, filters=filters, nworkers=2)
+    assert np.array_equal(c.frames, Video(C, filters=[AUGPhantomV711()]).frames)
+
+    # The lazy video still uses the properties of its own frames
+    assert np.array_equal(a.frames[10], first)
+    assert np.array_equal(a.frames[150], Video(A, filters=[AUGPhantomV711()]).frames[150])
+
+    a.close()